@@ -0,0 +1,33 @@
+{% macro apply_edfi_deletes(table_name) %}
+    {{ return(adapter.dispatch('apply_edfi_deletes')(table_name)) }}
+{% endmacro %}
+
+{% macro default__apply_edfi_deletes(table_name) %}
+
+{% if is_incremental() %}
+delete from {{ this }}
+where id in (
+    select deletes.id
+    from {{ source('staging', table_name) }} deletes
+    left join (
+        select
+            school_year,
+            tenant,
+            max(date_extracted) as date_extracted
+        from {{ this }}
+        group by 1, 2
+    ) loaded_extract
+        on deletes.school_year = loaded_extract.school_year
+        and deletes.tenant is not distinct from loaded_extract.tenant
+    where
+        deletes.extract_type = 'deletes'
+        and deletes.id is not null
+        and (
+            loaded_extract.date_extracted is null
+            or deletes.date_extracted >= loaded_extract.date_extracted)
+)
+{% else %}
+select 1
+{% endif %}
+
+{% endmacro %}
@@ -0,0 +1,41 @@
+{% macro remove_edfi_school_years_with_complete_extract(table_name) %}
+    {{ return(adapter.dispatch('remove_edfi_school_years_with_complete_extract')(table_name)) }}
+{% endmacro %}
+
+{% macro default__remove_edfi_school_years_with_complete_extract(table_name) %}
+
+{% if is_incremental() %}
+delete from {{ this }} existing
+where exists (
+    select 1
+    from (
+        select
+            school_year,
+            tenant,
+            max(date_extracted) as date_extracted
+        from {{ source('staging', table_name) }}
+        where is_complete_extract is true
+        group by 1, 2
+    ) latest_extract
+    left join (
+        select
+            school_year,
+            tenant,
+            max(date_extracted) as date_extracted
+        from {{ this }}
+        group by 1, 2
+    ) loaded_extract
+        on latest_extract.school_year = loaded_extract.school_year
+        and latest_extract.tenant is not distinct from loaded_extract.tenant
+    where
+        latest_extract.school_year = existing.school_year
+        and latest_extract.tenant is not distinct from existing.tenant
+        and (
+            loaded_extract.date_extracted is null
+            or latest_extract.date_extracted > loaded_extract.date_extracted)
+)
+{% else %}
+select 1
+{% endif %}
+
+{% endmacro %}
@@ -1,27 +1,65 @@
-
 {% macro retrieve_edfi_records_from_data_lake(table_name) %}
 
+{%- if var('edfi_incremental_staging') %}
+{{ config(pre_hook=[
+    "{{ apply_edfi_deletes('" ~ table_name ~ "') }}",
+    "{{ remove_edfi_school_years_with_complete_extract('" ~ table_name ~ "') }}"
+]) }}
+{%- endif %}
+
+-- extracts are scoped to a school year and tenant. tenant
+-- is null for the default instance.
 with latest_extract as (
 
     select
         school_year,
+        tenant,
         max(date_extracted) as date_extracted
     from {{ source('staging', table_name) }}
     where is_complete_extract is true
-    group by 1
+    group by 1, 2
+
+),
+
+{% if is_incremental() %}
+loaded_extract as (
+
+    select
+        school_year,
+        tenant,
+        max(date_extracted) as date_extracted
+    from {{ this }}
+    group by 1, 2
 
 ),
+{% endif %}
 
 records as (
 
     select base_table.*
     from {{ source('staging', table_name) }} base_table
-    left join latest_extract on base_table.school_year = latest_extract.school_year
+    left join latest_extract
+        on base_table.school_year = latest_extract.school_year
+        and base_table.tenant is not distinct from latest_extract.tenant
+    {% if is_incremental() -%}
+    left join loaded_extract
+        on base_table.school_year = loaded_extract.school_year
+        and base_table.tenant is not distinct from loaded_extract.tenant
+    {%- endif %}
     where
         id is not null
         and (
             latest_extract.date_extracted is null
             or base_table.date_extracted >= latest_extract.date_extracted)
+        {% if is_incremental() -%}
+        -- only the latest merged extract and newer ones. the
+        -- latest merged extract is read again because a retried
+        -- run adds files to its folder. merging on id makes
+        -- reading it again idempotent.
+        and (
+            loaded_extract.date_extracted is null
+            or base_table.date_extracted >= loaded_extract.date_extracted)
+        {%- endif %}
 
 )
 
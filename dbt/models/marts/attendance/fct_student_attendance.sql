@@ -1,5 +1,200 @@
+{{ config(
+    materialized='incremental' if var('edfi_incremental_attendance') else 'table',
+    incremental_strategy='insert_overwrite',
+    partition_by={'field': 'date', 'data_type': 'date'},
+    cluster_by=['school_key', 'student_key'],
+    on_schema_change='append_new_columns',
+    tags=['refresh_daily']
+) }}
 
-with student_attendance as (
+with source_extract as (
+
+    -- latest extract read by this build. stored on each row
+    -- so the next incremental build can find what changed.
+    select max(date_extracted) as date_extracted
+    from (
+        select date_extracted from {{ ref('stg_edfi_student_school_associations') }}
+        union all
+        select date_extracted from {{ ref('stg_edfi_student_school_attendance_events') }}
+        union all
+        select date_extracted from {{ ref('stg_edfi_student_section_attendance_events') }}
+    )
+
+),
+
+{% if is_incremental() %}
+loaded_extract as (
+
+    select
+        max(source_extracted_at) as date_extracted,
+        max(date) as date
+    from {{ this }}
+
+),
+
+-- school years with extracts not yet read by this model.
+-- the latest read extract is included because a retried
+-- run adds files to it. read from the data lake so deletes
+-- and complete extracts count too.
+changed_school_years as (
+
+    select distinct school_year
+    from (
+        select school_year, date_extracted
+        from {{ source('staging', 'base_edfi_student_school_associations') }}
+        union all
+        select school_year, date_extracted
+        from {{ source('staging', 'base_edfi_student_school_attendance_events') }}
+        union all
+        select school_year, date_extracted
+        from {{ source('staging', 'base_edfi_student_section_attendance_events') }}
+    )
+    where date_extracted >= (select date_extracted from loaded_extract)
+
+),
+
+-- rows that can have been deleted from staging, so the
+-- anti-joins below do not scan the whole table
+existing_in_changed_school_years as (
+
+    select *
+    from {{ this }}
+    where school_year in (select school_year from changed_school_years)
+
+),
+
+changed_dates as (
+
+    select event_date as date
+    from {{ ref('stg_edfi_student_school_attendance_events') }}
+    where date_extracted >= (select date_extracted from loaded_extract)
+
+    union all
+
+    select event_date as date
+    from {{ ref('stg_edfi_student_section_attendance_events') }}
+    where date_extracted >= (select date_extracted from loaded_extract)
+
+    union all
+
+    -- an enrollment change can move the entry date either way,
+    -- so recompute from the earlier of the new entry date and
+    -- the student's first materialized date
+    select least(ssa.entry_date, ifnull(min(existing.date), ssa.entry_date)) as date
+    from {{ ref('stg_edfi_student_school_associations') }} ssa
+    left join existing_in_changed_school_years existing
+        on existing.student_key = {{ dbt_utils.generate_surrogate_key([
+            'ssa.student_reference.student_unique_id',
+            'ssa.school_year'
+        ]) }}
+    where ssa.date_extracted >= (select date_extracted from loaded_extract)
+    group by ssa.entry_date
+
+    union all
+
+    -- school attendance events deleted from staging
+    select existing.date
+    from existing_in_changed_school_years existing
+    left join {{ ref('stg_edfi_student_school_attendance_events') }} school_attendance
+        on existing.student_key = {{ dbt_utils.generate_surrogate_key([
+            'school_attendance.student_reference.student_unique_id',
+            'school_attendance.school_year'
+        ]) }}
+        and existing.school_key = {{ dbt_utils.generate_surrogate_key([
+            'school_attendance.school_reference.school_id',
+            'school_attendance.school_year'
+        ]) }}
+        and existing.date = school_attendance.event_date
+    where
+        (
+            existing.school_attendance_event_category_descriptor != 'In Attendance'
+            or existing.reported_as_present_at_school = 1
+        )
+        and school_attendance.id is null
+
+    union all
+
+    -- section attendance events deleted from staging
+    select existing.date
+    from existing_in_changed_school_years existing
+    left join {{ ref('stg_edfi_student_section_attendance_events') }} section_attendance
+        on existing.student_key = {{ dbt_utils.generate_surrogate_key([
+            'section_attendance.student_reference.student_unique_id',
+            'section_attendance.school_year'
+        ]) }}
+        and existing.school_key = {{ dbt_utils.generate_surrogate_key([
+            'section_attendance.section_reference.school_id',
+            'section_attendance.school_year'
+        ]) }}
+        and existing.date = section_attendance.event_date
+    where
+        (
+            existing.reported_as_present_at_home_room = 1
+            or existing.reported_as_absent_from_home_room = 1
+        )
+        and section_attendance.id is null
+
+    union all
+
+    -- enrollments deleted from staging
+    select min(existing.date) as date
+    from existing_in_changed_school_years existing
+    left join (
+        select distinct
+            {{ dbt_utils.generate_surrogate_key([
+                'student_reference.student_unique_id',
+                'school_year'
+            ]) }} as student_key,
+            {{ dbt_utils.generate_surrogate_key([
+                'school_reference.school_id',
+                'school_year'
+            ]) }} as school_key
+        from {{ ref('stg_edfi_student_school_associations') }}
+    ) enrolled
+        on existing.student_key = enrolled.student_key
+        and existing.school_key = enrolled.school_key
+    where enrolled.student_key is null
+
+    union all
+
+    -- days since the last build
+    select date_add(date, interval 1 day) as date
+    from loaded_extract
+
+    union all
+
+    -- rows built before source_extracted_at was
+    -- stored cannot be compared, so rebuild all
+    select date '1900-01-01' as date
+    from loaded_extract
+    where date_extracted is null
+
+),
+
+recompute_from as (
+
+    select ifnull(min(date), date '1900-01-01') as date
+    from changed_dates
+
+),
+
+-- running totals up to the day before the recomputed dates
+carried_totals as (
+
+    select
+        student_key,
+        number_days_enrolled_thus_far,
+        sum_event_duration_thus_far
+    from {{ this }}
+    where date < (select date from recompute_from)
+    qualify row_number() over (
+        partition by student_key
+        order by date desc) = 1
+
+),
+{% endif %}
+
+student_attendance as (
 
     select
         {{ dbt_utils.generate_surrogate_key([
@@ -89,6 +284,9 @@ with student_attendance as (
         and student_section_associations.section_reference.session_name = section_attendance.section_reference.session_name
     where
         calendar_dates.date < current_date
+        {% if is_incremental() -%}
+        and calendar_dates.date >= (select date from recompute_from)
+        {%- endif %}
         and calendar_events.calendar_event_descriptor in ('Instructional day', 'Student late arrival/early dismissal')
     group by
         ssa.student_reference.student_unique_id,
@@ -101,6 +299,28 @@ with student_attendance as (
 
 )
 
+{% if is_incremental() %}
+, student_attendance_with_carried_totals as (
+
+    select
+        student_attendance.* replace (
+            ifnull(carried_totals.number_days_enrolled_thus_far, 0)
+                + student_attendance.number_days_enrolled_thus_far      as number_days_enrolled_thus_far,
+            -- null until the student's first event, as in a full build
+            if(
+                carried_totals.sum_event_duration_thus_far is null,
+                student_attendance.sum_event_duration_thus_far,
+                carried_totals.sum_event_duration_thus_far
+                    + ifnull(student_attendance.sum_event_duration_thus_far, 0)
+            )                                                           as sum_event_duration_thus_far
+        )
+    from student_attendance
+    left join carried_totals
+        on student_attendance.student_key = carried_totals.student_key
+
+)
+{% endif %}
+
 select
     local_education_agency_key,
     school_key,
@@ -113,7 +333,14 @@ select
     reported_as_absent_from_school,
     reported_as_present_at_home_room,
     reported_as_absent_from_home_room,
+    number_days_enrolled_thus_far,
+    sum_event_duration_thus_far,
+    (select date_extracted from source_extract)                                                                    as source_extracted_at,
     if(sum_event_duration_thus_far >= 15, 1, 0)                                                                    as is_chronically_absent,
     if((number_days_enrolled_thus_far - sum_event_duration_thus_far) / number_days_enrolled_thus_far < 0.92, 1, 0) as is_on_the_verge -- early warning indicator
+{% if is_incremental() -%}
+from student_attendance_with_carried_totals
+{%- else -%}
 from student_attendance
+{%- endif %}
 
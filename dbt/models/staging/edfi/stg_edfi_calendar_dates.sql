@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     id                                      as id,
     parse_date('%Y-%m-%d', json_value(data, '$.date')) as date,
     array(
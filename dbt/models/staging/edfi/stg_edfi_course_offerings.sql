@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     json_value(data, '$.id') as id,
     json_value(data, '$.localCourseCode') as local_course_code,
     json_value(data, '$.localCourseTitle') as local_course_title,
@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     id                                      as id,
     json_value(data, '$.courseCode') as course_code,
     json_value(data, '$.courseTitle') as course_title,
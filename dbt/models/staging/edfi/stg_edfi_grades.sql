@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     id                                      as id,
     cast(json_value(data, '$.numericGradeEarned') as float64) as numeric_grade_earned,
     json_value(data, '$.letterGradeEarned') as letter_grade_earned,
@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     id                                      as id,
     split(json_value(data, "$.gradingPeriodDescriptor"), '#')[OFFSET(1)] as grading_period_name,
     cast(json_value(data, "$.periodSequence") as int64) as period_sequence,
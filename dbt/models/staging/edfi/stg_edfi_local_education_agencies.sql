@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     id                                      as id,
     json_value(data, '$.localEducationAgencyId') as local_education_agency_id,
     json_value(data, '$.nameOfInstitution') as name_of_institution
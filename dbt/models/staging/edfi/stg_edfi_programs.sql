@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     id                                      as id,
     json_value(data, '$.programName') as program_name,
     json_value(data, '$.programId') as program_id,
@@ -4,6 +4,7 @@
 select distinct
     date_extracted                                  as date_extracted,
     cast(json_value(data, '$.schoolYear') as int64) as school_year,
+    tenant                                          as tenant,
     id                                      as id,
     json_value(data, '$.schoolYearDescription')     as school_year_description
 from records
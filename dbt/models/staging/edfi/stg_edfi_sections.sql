@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     id                                      as id,
     json_value(data, '$.sectionIdentifier') as section_identifier,
     json_value(data, '$.sectionName') as section_name,
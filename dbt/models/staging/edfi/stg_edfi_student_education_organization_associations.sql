@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     id                                      as id,
     struct(
         json_value(data, '$.educationOrganizationReference.educationOrganizationId') as education_organization_id
@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     json_value(data, '$.id') as id,
     struct(
         json_value(data, '$.schoolReference.schoolId') as school_id
@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     id                                      as id,
     struct(
         json_value(data, '$.studentReference.studentUniqueId') as student_unique_id
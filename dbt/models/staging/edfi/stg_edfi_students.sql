@@ -4,6 +4,7 @@
 select
     date_extracted                          as date_extracted,
     school_year                             as school_year,
+    tenant                                  as tenant,
     id                                      as id,
     json_value(data, '$.studentUniqueId') as student_unique_id,
     json_value(data, '$.lastSurname') as last_surname,
@@ -1,14 +1,156 @@
+import json
 import os
-from pathlib import Path
+from typing import Dict, List, Optional, Set
 
-from dagster import AssetExecutionContext
+from dagster import AssetExecutionContext, AssetKey, DagsterEventType, EventRecordsFilter
 from dagster_dbt import DbtCliResource, dbt_assets
 
-dbt_manifest_path = os.getenv("DBT_PROFILES_DIR")+"/target/manifest.json"
+# parse the project when the code location loads so the
+# assets and the model selection below always match the
+# models and tags on disk
+dbt_parse_invocation = DbtCliResource(
+    project_dir=os.getenv("DBT_PROJECT_DIR"),
+    profiles_dir=os.getenv("DBT_PROFILES_DIR"),
+    target="prod",
+).cli(["--quiet", "parse"]).wait()
+dbt_manifest_path = dbt_parse_invocation.target_path.joinpath("manifest.json")
 
-@dbt_assets(manifest=Path("target", dbt_manifest_path))
+# dbt sources loaded by the extract_and_load assets
+EDFI_SOURCE_PREFIX = "source.project.staging.base_edfi_"
+# models whose rows depend on current_date, so they
+# run even when no Ed-Fi source changed
+REFRESH_DAILY_TAG = "refresh_daily"
+# run tag holding the unix timestamp after which source
+# materializations count, set when dbt runs as its own job
+CHANGED_SINCE_TAG = "edfi/changed_since"
+
+
+def get_descendant_models(manifest: Dict, unique_ids: List[str]) -> Set[str]:
+    """
+    Return the unique ids of every model
+    downstream of the passed in dbt nodes.
+    """
+    descendants = set()
+    to_visit = list(unique_ids)
+    while to_visit:
+        for child in manifest["child_map"].get(to_visit.pop(), []):
+            if child.startswith("model.") and child not in descendants:
+                descendants.add(child)
+                to_visit.append(child)
+
+    return descendants
+
+
+def get_source_events(context: AssetExecutionContext, asset_key: AssetKey) -> List:
+    """
+    Return the materializations of a source that
+    this dbt run should pick up: those made in this
+    run, or since the timestamp in the CHANGED_SINCE_TAG
+    run tag when dbt runs as its own job.
+    """
+    changed_since = context.run.tags.get(CHANGED_SINCE_TAG)
+    if changed_since is not None:
+        records = context.instance.get_event_records(
+            EventRecordsFilter(
+                event_type=DagsterEventType.ASSET_MATERIALIZATION,
+                asset_key=asset_key,
+                after_timestamp=float(changed_since),
+            )
+        )
+        return [record.event_log_entry for record in records]
+
+    _, runs = context.instance.get_run_group(context.run_id)
+    run_ids = {run.run_id for run in runs}
+    event = context.instance.get_latest_materialization_events([asset_key]).get(asset_key)
+    if event is None or event.run_id not in run_ids:
+        return []
+
+    return [event]
+
+
+def get_changed_edfi_sources(context: AssetExecutionContext, manifest: Dict) -> Optional[List[str]]:
+    """
+    Return the Ed-Fi sources whose extract_and_load
+    asset changed or deleted records, or None if no
+    source was materialized since the last dbt run.
+    """
+    source_ids = [
+        unique_id for unique_id in manifest["sources"] if unique_id.startswith(EDFI_SOURCE_PREFIX)
+    ]
+
+    materialized = False
+    changed = list()
+    for unique_id in source_ids:
+        asset_key = AssetKey(["staging", manifest["sources"][unique_id]["name"]])
+        for event in get_source_events(context, asset_key):
+            materialized = True
+
+            metadata = event.asset_materialization.metadata
+            number_of_records = sum(
+                metadata[label].value
+                for label in ("Changed records", "Deleted records")
+                if label in metadata
+            )
+            if number_of_records > 0:
+                changed.append(unique_id)
+                break
+
+    return changed if materialized else None
+
+
+@dbt_assets(manifest=dbt_manifest_path)
 def edfi_dbt_assets(context: AssetExecutionContext, dbt: DbtCliResource):
-    dbt_run_invocation = dbt.cli(["run"], context=context)
+    """
+    Run the dbt models downstream of the Ed-Fi sources
+    that changed. Models that do not depend on Ed-Fi
+    sources always run. Everything runs when no source
+    was materialized since the last dbt run. When no
+    source changed, only models tagged refresh_daily run.
+    """
+    with open(dbt_manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    refresh_daily_models = {
+        unique_id for unique_id, node in manifest["nodes"].items()
+        if unique_id.startswith("model.") and REFRESH_DAILY_TAG in node.get("tags", [])
+    }
+
+    args = ["run"]
+    changed_sources = get_changed_edfi_sources(context, manifest)
+    if changed_sources is not None:
+        if not changed_sources:
+            if not refresh_daily_models:
+                context.log.info("No Ed-Fi source changed. Skipping dbt run")
+                return
+
+            context.log.info(
+                "No Ed-Fi source changed. Running only models "
+                f"tagged {REFRESH_DAILY_TAG}"
+            )
+            other_models = {
+                unique_id for unique_id in manifest["nodes"] if unique_id.startswith("model.")
+            } - refresh_daily_models
+            args += ["--exclude", *sorted(manifest["nodes"][unique_id]["name"] for unique_id in other_models)]
+            yield from dbt.cli(args, context=context).stream()
+            return
+
+        edfi_models = get_descendant_models(
+            manifest,
+            [unique_id for unique_id in manifest["sources"] if unique_id.startswith(EDFI_SOURCE_PREFIX)],
+        )
+        unchanged_models = (
+            edfi_models - get_descendant_models(manifest, changed_sources) - refresh_daily_models
+        )
+        context.log.info(
+            f"Ed-Fi sources changed: {', '.join(sorted(changed_sources))}. "
+            f"Skipping {len(unchanged_models)} unaffected models"
+        )
+        if unchanged_models:
+            # dagster adds its own --select for the asset
+            # selection, so unaffected models are excluded
+            args += ["--exclude", *sorted(manifest["nodes"][unique_id]["name"] for unique_id in unchanged_models)]
+
+    dbt_run_invocation = dbt.cli(args, context=context)
 
     yield from dbt_run_invocation.stream()
 
@@ -17,4 +159,3 @@ def edfi_dbt_assets(context: AssetExecutionContext, dbt: DbtCliResource):
 
     # Retrieve the `run_results.json` dbt artifact as a file path:
     run_results_path = dbt_run_invocation.target_path.joinpath("run_results.json")
-
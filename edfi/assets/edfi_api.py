@@ -1,13 +1,43 @@
-import json, os
-from datetime import datetime
-
-from typing import Union
-
-from dagster import AssetKey, MetadataValue, Output, asset, Config, fs_io_manager, get_dagster_logger
+import time
+
+from typing import Dict
+
+from dagster import (
+    AssetKey,
+    DagsterEventType,
+    EventRecordsFilter,
+    MetadataValue,
+    Output,
+    asset,
+    Config,
+    fs_io_manager,
+    get_dagster_logger,
+)
 
 from assets.edfi_api_endpoints import EDFI_API_ENDPOINTS
+from assets.edfi_extract import (
+    DataLakeFileWriter,
+    ExtractionProfiler,
+    PrefetchingPages,
+    build_checkpoint_path,
+    build_data_lake_path,
+    build_profile_path,
+    build_watermark_path,
+    delete_previous_attempt_files,
+    get_endpoint_file_prefix,
+    get_endpoint_previous_change_version,
+    get_launch_datetime,
+    get_root_run_id,
+    is_deletes_endpoint,
+    load_checkpoint,
+    save_checkpoint,
+    save_watermark,
+)
+from assets.edfi_partitions import edfi_partitions_def, get_partition_school_year_and_tenant
 
-from resources.edfi_api_resource import EdFiApiClient, EdFiCurrentYearConfig, EdFiApiResource 
+from resources.edfi_api_resource import (
+    EdFiApiClient, EdFiCurrentYearConfig, EdFiApiResource, summarize_latencies
+)
 from resources.gcs_resource import GcsClient, GcsConfig, GcsResource
 from resources.bq_resource import BigQueryClient
 
@@ -15,6 +45,7 @@ from resources.bq_resource import BigQueryClient
 @asset(
     group_name="source",
     key_prefix=["staging"],
+    partitions_def=edfi_partitions_def,
 )
 def change_query_versions(
     context, 
@@ -28,6 +59,8 @@ def change_query_versions(
     Use 0 if this is the first time the asset is being materialized.
 
     Use -1 and -1 if the run config is set to not use change queries.
+
+    Partitioned runs track change versions per school year and tenant.
     """
     base_url: str = config.base_url
     api_key: str = config.api_key
@@ -37,7 +70,8 @@ def change_query_versions(
     api_version: str = config.api_version
     use_change_queries: bool = config.use_change_queries
 
-    edfi_api_client = edfi_api_client.init_edfi_resource()
+    school_year, tenant = get_partition_school_year_and_tenant(context, config.school_year)
+    edfi_api_client = edfi_api_client.init_edfi_resource(tenant)
 
     if not use_change_queries: 
         context.log.info("Will not use change queries")
@@ -45,26 +79,36 @@ def change_query_versions(
         newest_change_version = -1
     else:
         context.log.info("Using change queries")
-        school_year = config.school_year
         previous_change_version = 0
 
-        try:
-            # get previous materialization events
-            last_materialization = context.instance.get_latest_materialization_events(
-                asset_keys=[AssetKey(("staging", "change_query_versions"))]
+        asset_key = AssetKey(("staging", "change_query_versions"))
+        # get previous materialization event
+        if context.has_partition_key:
+            # of this partition only
+            records = context.instance.get_event_records(
+                EventRecordsFilter(
+                    event_type=DagsterEventType.ASSET_MATERIALIZATION,
+                    asset_key=asset_key,
+                    asset_partitions=[context.partition_key],
+                ),
+                limit=1,
+                ascending=False,
             )
-            # iterate through metadata entries looking for previous change version number
-            for metadata_entry in last_materialization[
-                AssetKey(("staging", "change_query_versions"))
-            ].dagster_event.event_specific_data.materialization.metadata_entries:
-                if metadata_entry.label == "Newest change version":
-                    # change version number found
-                    previous_change_version = metadata_entry.entry_data.value
-                    context.log.debug(
-                        f"Setting previous change version to: {previous_change_version}"
-                    )
-        except:
+            last_materialization = records[0].event_log_entry if records else None
+        else:
+            last_materialization = context.instance.get_latest_materialization_events(
+                asset_keys=[asset_key]
+            ).get(asset_key)
+
+        if last_materialization is None:
             context.log.info("Did not find previous asset materialization")
+        else:
+            metadata = last_materialization.asset_materialization.metadata
+            if "Newest change version" in metadata:
+                previous_change_version = metadata["Newest change version"].value
+                context.log.debug(
+                    f"Setting previous change version to: {previous_change_version}"
+                )
 
         response = edfi_api_client.get_available_change_versions(
             school_year
@@ -86,6 +130,32 @@ def change_query_versions(
     )
 
 
+def upload_profile(context, data_lake, profiler: ExtractionProfiler, path: str) -> Dict:
+    """
+    Stop the profiler, upload its report and return
+    the profile metadata. Profiling errors are logged
+    so they do not hide an extraction error.
+    """
+    try:
+        profile_path = data_lake.upload_bytes(
+            path, profiler.stop(), content_type="application/octet-stream"
+        )
+    except Exception as err:
+        context.log.warning(f"Failed to upload extraction profile to {path}: {err}")
+        return dict()
+
+    context.log.info(f"Uploaded extraction profile to {profile_path}")
+    profile_metadata = {"Profile": MetadataValue.path(profile_path)}
+    if profiler.profile_mode == "cprofile":
+        context.log.info(profiler.summary())
+    else:
+        profile_metadata["Peak traced memory bytes"] = MetadataValue.int(
+            profiler.peak_memory_bytes
+        )
+
+    return profile_metadata
+
+
 edfi_assets = list()
 for edfi_asset in EDFI_API_ENDPOINTS:
     """
@@ -99,6 +169,7 @@ for edfi_asset in EDFI_API_ENDPOINTS:
             name=edfi_asset["asset"],
             group_name="source",
             key_prefix=["staging"],
+            partitions_def=edfi_partitions_def,
         )
         def extract_and_load(
                 context, 
@@ -110,9 +181,9 @@ for edfi_asset in EDFI_API_ENDPOINTS:
 
             log = get_dagster_logger()
 
-            school_year = config.school_year
+            school_year, tenant = get_partition_school_year_and_tenant(context, config.school_year)
 
-            edfi_api_client = edfi_api_client.init_edfi_resource()
+            edfi_api_client = edfi_api_client.init_edfi_resource(tenant, config.api_concurrency)
 
             data_lake = data_lake.init_gcs_resource()
 
@@ -121,84 +192,316 @@ for edfi_asset in EDFI_API_ENDPOINTS:
             newest_change_version = change_query_versions["newest_change_version"]
 
             # dagster run datetime. used in gcs filepath.
-            stats = context.instance.event_log_storage.get_stats_for_run(context.run_id)
-            launch_datetime = datetime.utcfromtimestamp(stats.launch_time)
-
+            launch_datetime = get_launch_datetime(context)
+            root_run_id = get_root_run_id(context)
+            is_complete_extract = previous_change_version == -1
+
+            stage_seconds = {
+                "fetch": 0.0,
+                "fetch_blocked": 0.0,
+                "serialize": 0.0,
+                "upload": 0.0,
+                "upload_wait": 0.0,
+            }
             number_of_changed_records = 0
             changed_records_gcs_paths = []
             number_of_deleted_records = 0
             deleted_records_gcs_paths = []
-            for endpoint in edfi_asset["endpoints"]:
-
-                if (
-                    previous_change_version == -1
-                    and newest_change_version == -1
-                    and "/deletes" in endpoint
-                ):
-                    # skip api endpoint if run config set to not use
-                    # change queries and if endpoint is a deletes endpoint
-                    context.log.info(f"Skipping the endpoint {endpoint}")
-                    continue
-
-                file_number = 1
-                # process yielded records from generator
-                for yielded_response in edfi_api_client.get_data(
-                    api_endpoint=endpoint,
-                    school_year=school_year,
-                    previous_change_version=previous_change_version,
-                    newest_change_version=newest_change_version,
-                ):
-
-                    records_to_upload = []
-                    extract_type = "deletes" if "/deletes" in endpoint else "records"
-
-                    # iterate through each record in page of api results
-                    for response in yielded_response:
-                        if "/deletes" in endpoint:
-                            id = response["Id"].replace("-", "")
-                            number_of_deleted_records += 1
+            # records reported by Total-Count. None once an
+            # endpoint does not report a count.
+            expected_changed_records = 0
+            expected_deleted_records = 0
+            endpoint_telemetry = dict()
+            all_latencies = []
+            skipped_endpoints = 0
+
+            profiler = None
+            if config.profile_mode:
+                profiler = ExtractionProfiler(config.profile_mode)
+                profiler.start()
+
+            profile_metadata = dict()
+            try:
+                for endpoint in edfi_asset["endpoints"]:
+
+                    if (
+                        previous_change_version == -1
+                        and newest_change_version == -1
+                        and is_deletes_endpoint(endpoint)
+                    ):
+                        # skip api endpoint if run config set to not use
+                        # change queries and if endpoint is a deletes endpoint
+                        context.log.info(f"Skipping the endpoint {endpoint}")
+                        continue
+
+                    watermark_path = build_watermark_path(
+                        edfi_asset["asset"], school_year, endpoint, tenant
+                    )
+                    endpoint_previous_change_version = get_endpoint_previous_change_version(
+                        data_lake, watermark_path, previous_change_version, newest_change_version
+                    )
+
+                    # cheap probe so unchanged endpoints
+                    # are skipped without paging
+                    if endpoint_previous_change_version > newest_change_version:
+                        total_count = 0
+                    else:
+                        total_count = edfi_api_client.get_total_count(
+                            endpoint, school_year, endpoint_previous_change_version, newest_change_version
+                        )
+                    if total_count == 0:
+                        context.log.info(f"No changes to endpoint {endpoint}. Skipping")
+                        skipped_endpoints += 1
+                        if newest_change_version > -1:
+                            save_watermark(data_lake, watermark_path, endpoint, newest_change_version)
+                        continue
+
+                    def build_path(file_number):
+                        return build_data_lake_path(
+                            edfi_asset["asset"],
+                            edfi_api_client.api_version,
+                            school_year,
+                            launch_datetime,
+                            endpoint,
+                            file_number,
+                            config.output_format,
+                            tenant,
+                        )
+
+                    # resume from the checkpoint left by a failed
+                    # attempt of this run for the same change window
+                    paging = "partitioned" if config.partitioned_extraction else "offset"
+                    checkpoint_path = build_checkpoint_path(
+                        edfi_asset["asset"], school_year, root_run_id, endpoint, tenant
+                    )
+                    checkpoint = load_checkpoint(
+                        data_lake,
+                        checkpoint_path,
+                        endpoint_previous_change_version,
+                        newest_change_version,
+                        config.output_format,
+                        paging,
+                    )
+                    if checkpoint is not None and checkpoint["complete"]:
+                        context.log.info(f"Endpoint {endpoint} already extracted by a previous attempt")
+                        if is_deletes_endpoint(endpoint):
+                            number_of_deleted_records += checkpoint["number_of_records"]
+                            if expected_deleted_records is not None:
+                                expected_deleted_records += checkpoint["number_of_records"]
                         else:
-                            id = response["id"].replace("-", "")
-                            number_of_changed_records += 1
-
-                        records_to_upload.append(
-                            {
-                                "is_complete_extract": True
-                                if previous_change_version == -1
-                                else False,
-                                "id": id,
-                                "data": json.dumps(response),
-                            }
+                            number_of_changed_records += checkpoint["number_of_records"]
+                            if expected_changed_records is not None:
+                                expected_changed_records += checkpoint["number_of_records"]
+                        continue
+                    elif checkpoint is not None:
+                        context.log.info(
+                            f"Resuming endpoint {endpoint} from {paging} "
+                            f"position {checkpoint['next_offset']}"
+                        )
+                    elif root_run_id != context.run_id:
+                        # no usable checkpoint. remove files a previous
+                        # attempt wrote so they are not read twice.
+                        delete_previous_attempt_files(data_lake, build_path)
+
+                    def checkpoint_writer(writer, complete=False):
+                        save_checkpoint(
+                            data_lake,
+                            checkpoint_path,
+                            endpoint,
+                            endpoint_previous_change_version,
+                            newest_change_version,
+                            config.output_format,
+                            writer,
+                            complete,
+                            paging,
                         )
 
-                    # upload current set of records from generator
-                    path = data_lake.upload_json(
-                        path=(
-                            f"edfi_api/{edfi_asset['asset']}/api_version={edfi_api_client.api_version}/"
-                            f"school_year={school_year}/"
-                            f"date_extracted={launch_datetime}/extract_type={extract_type}/"
-                            f"{abs(hash(endpoint))}-{file_number:09}.json"
+                    writer = DataLakeFileWriter(
+                        data_lake,
+                        build_path,
+                        endpoint,
+                        is_complete_extract,
+                        config.output_format,
+                        config.parquet_row_group_size,
+                        config.target_file_bytes,
+                        config.target_file_rows,
+                        on_upload=checkpoint_writer,
+                        checkpoint=checkpoint,
+                        spool_dir=config.spool_dir,
+                        spool_key=(
+                            f"{checkpoint_path}|{paging}|{config.output_format}"
+                            f"|{endpoint_previous_change_version}|{newest_change_version}"
                         ),
-                        records=records_to_upload if records_to_upload else [{}],
+                        spool_max_bytes=config.spool_max_bytes,
+                        tenant=tenant,
                     )
-                    if "/deletes" in endpoint:
-                        deleted_records_gcs_paths.append(path)
+                    endpoint_start = time.perf_counter()
+                    edfi_api_client.pop_request_stats()
+                    resumed_records = writer.number_of_records
+                    # past any files spooled by an earlier attempt
+                    start_offset = writer.resume_offset
+                    if config.partitioned_extraction:
+                        # offsets in partitioned mode count pages of
+                        # the partition plan rather than records
+                        page_limit = 1
+                        pages = edfi_api_client.get_data_partitioned(
+                            api_endpoint=endpoint,
+                            school_year=school_year,
+                            previous_change_version=endpoint_previous_change_version,
+                            newest_change_version=newest_change_version,
+                            max_pages_per_partition=config.max_pages_per_partition,
+                            concurrency=config.api_concurrency,
+                            start_page=start_offset,
+                        )
                     else:
-                        changed_records_gcs_paths.append(path)
-                    file_number += 1
-                    context.log.debug(f"Uploaded records to: {path}")
+                        page_limit = edfi_api_client.get_page_limit(endpoint)
+                        pages = edfi_api_client.get_data(
+                            api_endpoint=endpoint,
+                            school_year=school_year,
+                            previous_change_version=endpoint_previous_change_version,
+                            newest_change_version=newest_change_version,
+                            concurrency=config.api_concurrency,
+                            start_offset=start_offset,
+                            total_count=total_count,
+                        )
+                    if config.pipeline_queue_size > 0:
+                        # fetch pages on a separate thread so the api
+                        # and gcs connections are both kept busy
+                        pages = PrefetchingPages(pages, config.pipeline_queue_size)
+
+                    # process yielded records from generator
+                    fetch_start = time.perf_counter()
+                    for page_number, yielded_response in enumerate(pages, start=1):
+                        # buffer current set of records from generator.
+                        # files are uploaded in the background.
+                        writer.add_page(
+                            yielded_response,
+                            next_offset=start_offset + page_number * page_limit,
+                        )
+
+                    paths = writer.close()
+                    checkpoint_writer(writer, complete=True)
+                    if newest_change_version > -1:
+                        save_watermark(data_lake, watermark_path, endpoint, newest_change_version)
+                    if isinstance(pages, PrefetchingPages):
+                        stage_seconds["fetch"] += pages.fetch_seconds
+                        stage_seconds["fetch_blocked"] += pages.blocked_seconds
+                    else:
+                        stage_seconds["fetch"] += (
+                            time.perf_counter() - fetch_start
+                            - writer.serialize_seconds - writer.upload_wait_seconds
+                        )
+                    stage_seconds["serialize"] += writer.serialize_seconds
+                    stage_seconds["upload"] += writer.upload_seconds
+                    stage_seconds["upload_wait"] += writer.upload_wait_seconds
+
+                    endpoint_seconds = time.perf_counter() - endpoint_start
+                    request_stats = edfi_api_client.pop_request_stats()
+                    all_latencies.extend(request_stats["latencies"])
+                    endpoint_telemetry[endpoint] = {
+                        "requests": len(request_stats["latencies"]),
+                        "latency_seconds": summarize_latencies(request_stats["latencies"]),
+                        "response_bytes": request_stats["response_bytes"],
+                        "decode_seconds": request_stats["decode_seconds"],
+                        "upload_seconds": writer.upload_seconds,
+                        "seconds": endpoint_seconds,
+                        "rows_per_second": (writer.number_of_records - resumed_records)
+                        / max(endpoint_seconds, 1e-9),
+                    }
+                    context.log.debug(f"Uploaded records to: {', '.join(paths)}")
+                    if total_count is not None and writer.number_of_records != total_count:
+                        context.log.warning(
+                            f"Endpoint {endpoint} reported {total_count} records "
+                            f"but {writer.number_of_records} were extracted"
+                        )
+                    if is_deletes_endpoint(endpoint):
+                        number_of_deleted_records += writer.number_of_records
+                        deleted_records_gcs_paths.extend(paths)
+                        if total_count is None or expected_deleted_records is None:
+                            expected_deleted_records = None
+                        else:
+                            expected_deleted_records += total_count
+                    else:
+                        number_of_changed_records += writer.number_of_records
+                        changed_records_gcs_paths.extend(paths)
+                        if total_count is None or expected_changed_records is None:
+                            expected_changed_records = None
+                        else:
+                            expected_changed_records += total_count
+            finally:
+                # also on failure, where the profile is most useful
+                if profiler is not None:
+                    profile_metadata = upload_profile(
+                        context,
+                        data_lake,
+                        profiler,
+                        build_profile_path(edfi_asset["asset"], context.run_id, config.profile_mode),
+                    )
+
+            pool_stats = edfi_api_client.get_pool_stats()
+            retry_stats = edfi_api_client.get_retry_stats()
+
+            # numeric metadata per endpoint so each can be
+            # plotted over time in the asset catalog
+            telemetry_metadata = dict()
+            for endpoint, telemetry in endpoint_telemetry.items():
+                prefix = get_endpoint_file_prefix(endpoint)
+                for percentile, latency in telemetry["latency_seconds"].items():
+                    telemetry_metadata[f"{prefix} API latency {percentile} seconds"] = (
+                        MetadataValue.float(latency)
+                    )
+                telemetry_metadata[f"{prefix} API response bytes"] = MetadataValue.int(
+                    telemetry["response_bytes"]
+                )
+                telemetry_metadata[f"{prefix} JSON decode seconds"] = MetadataValue.float(
+                    telemetry["decode_seconds"]
+                )
+                telemetry_metadata[f"{prefix} GCS upload seconds"] = MetadataValue.float(
+                    telemetry["upload_seconds"]
+                )
+                telemetry_metadata[f"{prefix} rows per second"] = MetadataValue.float(
+                    telemetry["rows_per_second"]
+                )
+            for percentile, latency in summarize_latencies(all_latencies).items():
+                telemetry_metadata[f"API latency {percentile} seconds"] = MetadataValue.float(
+                    latency
+                )
+            telemetry_metadata["Endpoint telemetry"] = MetadataValue.json(endpoint_telemetry)
+
+            telemetry_metadata.update(profile_metadata)
 
             return Output(
                 value="Task successful",
                 metadata={
-                    "Changed records": MetadataValue.int(number_of_changed_records),
-                    "Deleted records": MetadataValue.int(number_of_deleted_records),
-                    "Changed records GCS paths": MetadataValue.text(
-                        ", ".join(changed_records_gcs_paths)
+                    "HTTP connections opened": MetadataValue.int(pool_stats["connections_opened"]),
+                    "HTTP connections reused": MetadataValue.int(pool_stats["connections_reused"]),
+                    "API retries": MetadataValue.int(retry_stats["retries"]),
+                    "API retry wait seconds": MetadataValue.float(retry_stats["retry_wait_seconds"]),
+                    "API throttled seconds": MetadataValue.float(retry_stats["throttled_seconds"]),
+                    "API rate limit (requests/s)": MetadataValue.float(
+                        retry_stats["requests_per_second"]
+                    ),
+                    "API fetch busy seconds": MetadataValue.float(stage_seconds["fetch"]),
+                    "API fetch blocked on full queue seconds": MetadataValue.float(
+                        stage_seconds["fetch_blocked"]
                     ),
-                    "Deleted records GCS paths": MetadataValue.text(
-                        ", ".join(deleted_records_gcs_paths)
+                    "Serialize busy seconds": MetadataValue.float(stage_seconds["serialize"]),
+                    "GCS upload busy seconds": MetadataValue.float(stage_seconds["upload"]),
+                    "Waiting on GCS upload seconds": MetadataValue.float(
+                        stage_seconds["upload_wait"]
                     ),
+                    "Skipped unchanged endpoints": MetadataValue.int(skipped_endpoints),
+                    "Changed records": MetadataValue.int(number_of_changed_records),
+                    "Deleted records": MetadataValue.int(number_of_deleted_records),
+                    "Expected changed records": MetadataValue.int(expected_changed_records)
+                    if expected_changed_records is not None
+                    else MetadataValue.text("unknown"),
+                    "Expected deleted records": MetadataValue.int(expected_deleted_records)
+                    if expected_deleted_records is not None
+                    else MetadataValue.text("unknown"),
+                    "Changed records GCS files": MetadataValue.int(len(changed_records_gcs_paths)),
+                    "Deleted records GCS files": MetadataValue.int(len(deleted_records_gcs_paths)),
+                    **telemetry_metadata,
                 },
             )
 
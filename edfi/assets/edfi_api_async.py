@@ -0,0 +1,288 @@
+import asyncio
+
+from dagster import AssetIn, AssetKey, AssetOut, MetadataValue, Output, multi_asset
+
+from assets.edfi_api_endpoints import EDFI_API_ENDPOINTS
+from assets.edfi_extract import (
+    DataLakeFileWriter,
+    build_checkpoint_path,
+    build_data_lake_path,
+    build_watermark_path,
+    delete_previous_attempt_files,
+    get_endpoint_previous_change_version,
+    get_launch_datetime,
+    get_root_run_id,
+    is_deletes_endpoint,
+    load_checkpoint,
+    save_checkpoint,
+    save_watermark,
+)
+from assets.edfi_partitions import edfi_partitions_def, get_partition_school_year_and_tenant
+
+from resources.edfi_api_resource import EdFiCurrentYearConfig, EdFiApiResource
+from resources.gcs_resource import GcsResource
+
+
+async def extract_and_load_asset(
+    context,
+    edfi_asset,
+    edfi_api_client,
+    data_lake,
+    school_year,
+    previous_change_version,
+    newest_change_version,
+    launch_datetime,
+    config,
+    tenant=None,
+):
+    """
+    Pull every endpoint of an asset, upload each page
+    to the data lake and return the asset's metadata.
+
+    Endpoints are extracted as by the threaded assets:
+    from their watermark, skipping unchanged endpoints
+    and resuming from the checkpoint of a failed attempt.
+    """
+    is_complete_extract = previous_change_version == -1
+    root_run_id = get_root_run_id(context)
+
+    number_of_changed_records = 0
+    changed_records_gcs_paths = []
+    number_of_deleted_records = 0
+    deleted_records_gcs_paths = []
+    skipped_endpoints = 0
+
+    async def extract_endpoint(endpoint):
+        nonlocal number_of_changed_records, number_of_deleted_records, skipped_endpoints
+
+        watermark_path = build_watermark_path(edfi_asset["asset"], school_year, endpoint, tenant)
+        endpoint_previous_change_version = await asyncio.to_thread(
+            get_endpoint_previous_change_version,
+            data_lake,
+            watermark_path,
+            previous_change_version,
+            newest_change_version,
+        )
+
+        # cheap probe so unchanged endpoints
+        # are skipped without paging
+        if endpoint_previous_change_version > newest_change_version:
+            total_count = 0
+        else:
+            total_count = await edfi_api_client.get_total_count(
+                endpoint, school_year, endpoint_previous_change_version, newest_change_version
+            )
+        if total_count == 0:
+            context.log.info(f"No changes to endpoint {endpoint}. Skipping")
+            skipped_endpoints += 1
+            if newest_change_version > -1:
+                await asyncio.to_thread(
+                    save_watermark, data_lake, watermark_path, endpoint, newest_change_version
+                )
+            return
+
+        def build_path(file_number):
+            return build_data_lake_path(
+                edfi_asset["asset"],
+                edfi_api_client.api_version,
+                school_year,
+                launch_datetime,
+                endpoint,
+                file_number,
+                config.output_format,
+                tenant,
+            )
+
+        # resume from the checkpoint left by a failed
+        # attempt of this run for the same change window
+        checkpoint_path = build_checkpoint_path(
+            edfi_asset["asset"], school_year, root_run_id, endpoint, tenant
+        )
+        checkpoint = await asyncio.to_thread(
+            load_checkpoint,
+            data_lake,
+            checkpoint_path,
+            endpoint_previous_change_version,
+            newest_change_version,
+            config.output_format,
+        )
+        if checkpoint is not None and checkpoint["complete"]:
+            context.log.info(f"Endpoint {endpoint} already extracted by a previous attempt")
+            if is_deletes_endpoint(endpoint):
+                number_of_deleted_records += checkpoint["number_of_records"]
+            else:
+                number_of_changed_records += checkpoint["number_of_records"]
+            return
+        elif checkpoint is not None:
+            context.log.info(
+                f"Resuming endpoint {endpoint} from offset position {checkpoint['next_offset']}"
+            )
+        elif root_run_id != context.run_id:
+            # no usable checkpoint. remove files a previous
+            # attempt wrote so they are not read twice.
+            await asyncio.to_thread(delete_previous_attempt_files, data_lake, build_path)
+
+        def checkpoint_writer(writer, complete=False):
+            save_checkpoint(
+                data_lake,
+                checkpoint_path,
+                endpoint,
+                endpoint_previous_change_version,
+                newest_change_version,
+                config.output_format,
+                writer,
+                complete,
+            )
+
+        writer = DataLakeFileWriter(
+            data_lake,
+            build_path,
+            endpoint,
+            is_complete_extract,
+            config.output_format,
+            config.parquet_row_group_size,
+            config.target_file_bytes,
+            config.target_file_rows,
+            on_upload=checkpoint_writer,
+            checkpoint=checkpoint,
+            spool_dir=config.spool_dir,
+            spool_key=(
+                f"{checkpoint_path}|offset|{config.output_format}"
+                f"|{endpoint_previous_change_version}|{newest_change_version}"
+            ),
+            spool_max_bytes=config.spool_max_bytes,
+            tenant=tenant,
+        )
+        page_limit = edfi_api_client.get_page_limit(endpoint)
+        # past any files spooled by an earlier attempt
+        start_offset = writer.resume_offset
+        page_number = 0
+        async for yielded_response in edfi_api_client.get_data(
+            api_endpoint=endpoint,
+            school_year=school_year,
+            previous_change_version=endpoint_previous_change_version,
+            newest_change_version=newest_change_version,
+            concurrency=config.api_concurrency,
+            start_offset=start_offset,
+            total_count=total_count,
+        ):
+            page_number += 1
+            # the writer blocks while a full buffer waits for
+            # the previous upload so keep it off the event loop
+            await asyncio.to_thread(
+                writer.add_page,
+                yielded_response,
+                start_offset + page_number * page_limit,
+            )
+
+        paths = await asyncio.to_thread(writer.close)
+        await asyncio.to_thread(checkpoint_writer, writer, True)
+        if newest_change_version > -1:
+            await asyncio.to_thread(
+                save_watermark, data_lake, watermark_path, endpoint, newest_change_version
+            )
+        context.log.debug(f"Uploaded records to: {', '.join(paths)}")
+        if total_count is not None and writer.number_of_records != total_count:
+            context.log.warning(
+                f"Endpoint {endpoint} reported {total_count} records "
+                f"but {writer.number_of_records} were extracted"
+            )
+        if is_deletes_endpoint(endpoint):
+            number_of_deleted_records += writer.number_of_records
+            deleted_records_gcs_paths.extend(paths)
+        else:
+            number_of_changed_records += writer.number_of_records
+            changed_records_gcs_paths.extend(paths)
+
+    endpoints = list()
+    for endpoint in edfi_asset["endpoints"]:
+        if (
+            previous_change_version == -1
+            and newest_change_version == -1
+            and is_deletes_endpoint(endpoint)
+        ):
+            # skip api endpoint if run config set to not use
+            # change queries and if endpoint is a deletes endpoint
+            context.log.info(f"Skipping the endpoint {endpoint}")
+            continue
+        endpoints.append(endpoint)
+
+    await asyncio.gather(*[extract_endpoint(endpoint) for endpoint in endpoints])
+
+    return {
+        "Skipped unchanged endpoints": MetadataValue.int(skipped_endpoints),
+        "Changed records": MetadataValue.int(number_of_changed_records),
+        "Deleted records": MetadataValue.int(number_of_deleted_records),
+        "Changed records GCS files": MetadataValue.int(len(changed_records_gcs_paths)),
+        "Deleted records GCS files": MetadataValue.int(len(deleted_records_gcs_paths)),
+    }
+
+
+@multi_asset(
+    name="extract_and_load_all",
+    outs={
+        edfi_asset["asset"]: AssetOut(
+            key_prefix=["staging"], group_name="source", is_required=False
+        )
+        for edfi_asset in EDFI_API_ENDPOINTS
+    },
+    ins={
+        "change_query_versions": AssetIn(
+            key=AssetKey(("staging", "change_query_versions"))
+        )
+    },
+    can_subset=True,
+    partitions_def=edfi_partitions_def,
+)
+def extract_and_load_all(
+        context,
+        config: EdFiCurrentYearConfig,
+        edfi_api_client: EdFiApiResource,
+        data_lake: GcsResource,
+        change_query_versions,
+    ):
+    """
+    Extract every Ed-Fi endpoint asset concurrently
+    from a single event loop, materializing the same
+    assets as the per-endpoint extract_and_load assets.
+    """
+    school_year, tenant = get_partition_school_year_and_tenant(context, config.school_year)
+    if config.partitioned_extraction:
+        context.log.warning(
+            "partitioned_extraction is not supported by the async engine. Using offset paging"
+        )
+    data_lake = data_lake.init_gcs_resource()
+    launch_datetime = get_launch_datetime(context)
+    edfi_assets_to_extract = [
+        edfi_asset for edfi_asset in EDFI_API_ENDPOINTS
+        if edfi_asset["asset"] in context.selected_output_names
+    ]
+
+    async def extract_all():
+        async with edfi_api_client.init_async_edfi_resource(tenant) as async_edfi_api_client:
+            results = await asyncio.gather(
+                *[
+                    extract_and_load_asset(
+                        context,
+                        edfi_asset,
+                        async_edfi_api_client,
+                        data_lake,
+                        school_year,
+                        change_query_versions["previous_change_version"],
+                        change_query_versions["newest_change_version"],
+                        launch_datetime,
+                        config,
+                        tenant,
+                    )
+                    for edfi_asset in edfi_assets_to_extract
+                ]
+            )
+
+        return zip(edfi_assets_to_extract, results)
+
+    for edfi_asset, metadata in asyncio.run(extract_all()):
+        yield Output(
+            value="Task successful",
+            output_name=edfi_asset["asset"],
+            metadata=metadata,
+        )
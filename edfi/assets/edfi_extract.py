@@ -0,0 +1,770 @@
+import cProfile
+import gzip
+import io
+import json
+import marshal
+import pstats
+import queue
+import re
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterable, List, Dict, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from assets.edfi_spool import DataLakeSpool
+
+
+# file extension of each supported data lake output format
+DATA_LAKE_FORMATS = {
+    "json": ".json",
+    "json_gzip": ".json.gz",
+    "parquet": ".parquet",
+}
+
+DATA_LAKE_CONTENT_TYPES = {
+    "json": "application/json",
+    "json_gzip": "application/gzip",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+DATA_LAKE_PARQUET_SCHEMA = pa.schema(
+    [
+        ("is_complete_extract", pa.bool_()),
+        ("id", pa.string()),
+        ("data", pa.string()),
+        # null for the default instance
+        ("tenant", pa.string()),
+    ]
+)
+
+
+def is_deletes_endpoint(endpoint: str) -> bool:
+    """
+    Return True if the endpoint is an
+    Ed-Fi deletes endpoint.
+    """
+    return "/deletes" in endpoint
+
+
+def get_root_run_id(context) -> str:
+    """
+    Return the id of the run that a retried or
+    re-executed run was started from.
+    """
+    return context.dagster_run.root_run_id or context.run_id
+
+
+def get_launch_datetime(context) -> datetime:
+    """
+    Return the dagster run launch datetime.
+    Used in the data lake file path.
+
+    Retries use the launch datetime of the root run
+    so they write into the same data lake partition.
+    Runs that were never launched, such as in process
+    runs from materialize, use their start time.
+    """
+    stats = context.instance.event_log_storage.get_stats_for_run(get_root_run_id(context))
+    run_time = stats.launch_time or stats.start_time
+    if run_time is None:
+        return datetime.utcnow()
+
+    return datetime.utcfromtimestamp(run_time)
+
+
+def get_endpoint_file_prefix(endpoint: str) -> str:
+    """
+    Return a stable file name prefix for an endpoint.
+    Example: /ed-fi/schools/deletes -> ed-fi_schools_deletes
+    """
+    return re.sub(r"[^A-Za-z0-9-]+", "_", endpoint).strip("_")
+
+
+def get_tenant_prefix(tenant: Optional[str]) -> str:
+    """
+    Return the prefix of a tenant's checkpoints and
+    watermarks. Those of the default instance keep
+    their original paths.
+    """
+    return f"tenants/{tenant}/" if tenant else ""
+
+
+def build_data_lake_path(
+    asset_name: str,
+    api_version: str,
+    school_year,
+    launch_datetime: datetime,
+    endpoint: str,
+    file_number: int,
+    output_format: str = "json",
+    tenant: Optional[str] = None,
+) -> str:
+    """
+    Build the hive partitioned data lake path
+    for a file of extracted records. A tenant's
+    files share the folders of the default
+    instance so the external tables read them,
+    and are named after the tenant.
+    """
+    if output_format not in DATA_LAKE_FORMATS:
+        raise ValueError(f"Unsupported data lake output format {output_format}")
+
+    extract_type = "deletes" if is_deletes_endpoint(endpoint) else "records"
+    file_prefix = get_endpoint_file_prefix(endpoint)
+    if tenant:
+        file_prefix = f"{tenant}-{file_prefix}"
+
+    return (
+        f"edfi_api/{asset_name}/api_version={api_version}/"
+        f"school_year={school_year}/"
+        f"date_extracted={launch_datetime}/extract_type={extract_type}/"
+        f"{file_prefix}-{file_number:09}{DATA_LAKE_FORMATS[output_format]}"
+    )
+
+
+def build_checkpoint_path(
+    asset_name: str, school_year, run_id: str, endpoint: str, tenant: Optional[str] = None
+) -> str:
+    """
+    Build the path of an endpoint's extraction
+    checkpoint. Kept outside the asset folders so
+    the external tables do not read it.
+    """
+    return (
+        f"{get_tenant_prefix(tenant)}edfi_api_checkpoints/{asset_name}/school_year={school_year}/"
+        f"run_id={run_id}/{get_endpoint_file_prefix(endpoint)}.json"
+    )
+
+
+def build_profile_path(asset_name: str, run_id: str, profile_mode: str) -> str:
+    """
+    Build the path of a run's extraction profile.
+    """
+    extension = ".prof" if profile_mode == "cprofile" else ".txt"
+
+    return f"edfi_api_profiles/{asset_name}/run_id={run_id}/{asset_name}{extension}"
+
+
+def build_watermark_path(
+    asset_name: str, school_year, endpoint: str, tenant: Optional[str] = None
+) -> str:
+    """
+    Build the path of an endpoint's change
+    version watermark.
+    """
+    return (
+        f"{get_tenant_prefix(tenant)}edfi_api_watermarks/{asset_name}/school_year={school_year}/"
+        f"{get_endpoint_file_prefix(endpoint)}.json"
+    )
+
+
+def load_watermark(data_lake, path: str) -> Optional[int]:
+    """
+    Return the newest change version an endpoint was
+    last extracted up to, or None if it never was.
+    """
+    watermark = data_lake.download_json(path)
+    if watermark is None:
+        return None
+
+    return watermark["change_version"]
+
+
+def save_watermark(data_lake, path: str, endpoint: str, change_version: int):
+    """
+    Save the newest change version an endpoint
+    has been extracted up to.
+    """
+    data_lake.upload_bytes(
+        path,
+        json.dumps(
+            {
+                "endpoint": endpoint,
+                "change_version": change_version,
+                "updated_at": datetime.utcnow().isoformat(),
+            }
+        ),
+    )
+
+
+def get_endpoint_previous_change_version(
+    data_lake, watermark_path: str, previous_change_version: int, newest_change_version: int
+) -> int:
+    """
+    Return the change version an endpoint's window
+    starts at. Each endpoint continues from the
+    newest change version it was last extracted up
+    to, so a failed endpoint does not widen the
+    window of the others.
+    """
+    if previous_change_version > -1 and newest_change_version > -1:
+        watermark = load_watermark(data_lake, watermark_path)
+        if watermark is not None:
+            # the watermark's version was extracted by a
+            # completed run and the window is inclusive
+            return watermark + 1
+
+    return previous_change_version
+
+
+def delete_previous_attempt_files(data_lake, path_builder: Callable[[int], str]):
+    """
+    Remove the files an earlier attempt of the run
+    wrote for an endpoint so they are not read twice.
+    """
+    data_lake.delete_files(path_builder(0).rsplit("-", 1)[0] + "-")
+
+
+def load_checkpoint(
+    data_lake,
+    path: str,
+    previous_change_version: int,
+    newest_change_version: int,
+    output_format: str,
+    paging: str = "offset",
+) -> Optional[Dict]:
+    """
+    Return the saved checkpoint if it was written for
+    the same change version window, output format
+    and paging mode.
+    """
+    checkpoint = data_lake.download_json(path)
+    if (
+        checkpoint is None
+        or checkpoint["previous_change_version"] != previous_change_version
+        or checkpoint["newest_change_version"] != newest_change_version
+        or checkpoint["output_format"] != output_format
+        or checkpoint.get("paging", "offset") != paging
+    ):
+        return None
+
+    return checkpoint
+
+
+def save_checkpoint(
+    data_lake,
+    path: str,
+    endpoint: str,
+    previous_change_version: int,
+    newest_change_version: int,
+    output_format: str,
+    writer: "DataLakeFileWriter",
+    complete: bool = False,
+    paging: str = "offset",
+):
+    """
+    Save how far the writer has uploaded an endpoint
+    so a retried run can continue from there.
+
+    With offset paging next_offset is an API offset,
+    with partitioned paging it is a page number.
+    """
+    data_lake.upload_bytes(
+        path,
+        json.dumps(
+            {
+                "endpoint": endpoint,
+                "previous_change_version": previous_change_version,
+                "newest_change_version": newest_change_version,
+                "output_format": output_format,
+                "paging": paging,
+                "next_offset": writer.uploaded_offset,
+                "file_number": writer.uploaded_file_number,
+                "number_of_records": writer.uploaded_records,
+                "complete": complete,
+            }
+        ),
+    )
+
+
+def drain(items: List) -> Iterable:
+    """
+    Yield the items of a list, releasing each one as
+    it is consumed so the list does not keep them alive.
+    """
+    for index in range(len(items)):
+        item = items[index]
+        items[index] = None
+        yield item
+
+
+def write_data_lake_file(
+    file_name: str,
+    output_format: str,
+    lines: List[bytes],
+    columns: Dict[str, List],
+    parquet_row_group_size: Optional[int] = None,
+):
+    """
+    Write buffered records to a local file
+    in the passed in output format.
+    """
+    if output_format == "parquet":
+        table = pa.Table.from_pydict(columns, schema=DATA_LAKE_PARQUET_SCHEMA)
+        pq.write_table(
+            table, file_name, row_group_size=parquet_row_group_size, compression="snappy"
+        )
+        return
+
+    open_file = gzip.open if output_format == "json_gzip" else open
+    with open_file(file_name, "wb") as data_file:
+        for line in drain(lines):
+            data_file.write(line)
+            data_file.write(b"\r\n")
+
+
+class RecordSerializer:
+    """
+    Convert API records of one endpoint into data lake
+    records. The id key and is_complete_extract value
+    are worked out once per endpoint, not per record.
+
+    Uses orjson when it is installed, which writes
+    compact JSON and leaves non-ASCII text unescaped.
+    Otherwise the standard json module is used.
+
+    Records also record the tenant they were
+    extracted from, null for the default instance.
+    """
+
+    def __init__(
+        self, endpoint: str, is_complete_extract: bool, use_orjson: bool = True,
+        tenant: Optional[str] = None,
+    ):
+        self.id_key = "Id" if is_deletes_endpoint(endpoint) else "id"
+        self.is_complete_extract = is_complete_extract
+        self.tenant = tenant
+        self.use_orjson = use_orjson and orjson is not None
+        self.line_prefix = (
+            '{"is_complete_extract": '
+            f'{"true" if is_complete_extract else "false"}, '
+            f'"tenant": {json.dumps(tenant)}, "id": '
+        ).encode("utf-8")
+
+    def dumps(self, record: Dict) -> str:
+        """
+        Return a record as a JSON string.
+        """
+        if self.use_orjson:
+            return orjson.dumps(record).decode("utf-8")
+
+        return json.dumps(record)
+
+    def to_line(self, record: Dict) -> bytes:
+        """
+        Return a record as a newline delimited JSON line,
+        written straight to bytes rather than built as a
+        dict and dumped again.
+        """
+        record_id = record[self.id_key].replace("-", "")
+        if self.use_orjson:
+            return b"".join(
+                (
+                    self.line_prefix,
+                    orjson.dumps(record_id),
+                    b', "data": ',
+                    orjson.dumps(orjson.dumps(record).decode("utf-8")),
+                    b"}",
+                )
+            )
+
+        return b"".join(
+            (
+                self.line_prefix,
+                json.dumps(record_id).encode("utf-8"),
+                b', "data": ',
+                json.dumps(json.dumps(record)).encode("utf-8"),
+                b"}",
+            )
+        )
+
+    def to_columns(self, page: List[Dict]) -> Dict[str, List]:
+        """
+        Return a page of records as data lake
+        columns for columnar output formats.
+        """
+        return {
+            "is_complete_extract": [self.is_complete_extract] * len(page),
+            "id": [record[self.id_key].replace("-", "") for record in page],
+            "data": [self.dumps(record) for record in page],
+            "tenant": [self.tenant] * len(page),
+        }
+
+
+class DataLakeFileWriter:
+    """
+    Write pages of API results for one endpoint to the
+    data lake, combining pages into files of roughly
+    target_file_bytes or target_file_rows. With neither
+    target set every page is written to its own file.
+
+    Files are uploaded on a background thread so paging
+    continues while the previous file uploads. Only one
+    upload is in flight at a time, so at most two files
+    worth of records are held in memory.
+
+    With spool_dir set, files are written to a local
+    DataLakeSpool instead and uploaded from there, so
+    paging does not wait on GCS. Files spooled by an
+    earlier attempt with the same spool_key are uploaded
+    first and extraction resumes after them.
+    """
+
+    def __init__(
+        self,
+        data_lake,
+        path_builder: Callable[[int], str],
+        endpoint: str,
+        is_complete_extract: bool,
+        output_format: str = "json",
+        parquet_row_group_size: Optional[int] = None,
+        target_file_bytes: int = 0,
+        target_file_rows: int = 0,
+        on_upload: Optional[Callable[["DataLakeFileWriter"], None]] = None,
+        checkpoint: Optional[Dict] = None,
+        spool_dir: Optional[str] = None,
+        spool_key: Optional[str] = None,
+        spool_max_bytes: int = 1024 * 1024 * 1024,
+        tenant: Optional[str] = None,
+    ):
+        self.data_lake = data_lake
+        self.path_builder = path_builder
+        self.endpoint = endpoint
+        self.is_complete_extract = is_complete_extract
+        self.output_format = output_format
+        self.parquet_row_group_size = parquet_row_group_size
+        self.target_file_bytes = target_file_bytes
+        self.target_file_rows = target_file_rows
+        self.on_upload = on_upload
+        self.serializer = RecordSerializer(endpoint, is_complete_extract, tenant=tenant)
+
+        # resume numbering and counts from a checkpoint
+        checkpoint = checkpoint or dict()
+        self.file_number = checkpoint.get("file_number", 0) + 1
+        self.paths = list()
+        self.number_of_records = checkpoint.get("number_of_records", 0)
+        self.uploaded_records = self.number_of_records
+        self.uploaded_offset = checkpoint.get("next_offset", 0)
+        self.uploaded_file_number = self.file_number - 1
+        self.serialize_seconds = 0.0
+        self.upload_seconds = 0.0
+        self.upload_wait_seconds = 0.0
+        self._reset_buffer()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_upload = None
+        self._lock = threading.Lock()
+
+        # offset to continue extracting from
+        self.resume_offset = self.uploaded_offset
+        self._spool = None
+        if spool_dir:
+            self._spool = DataLakeSpool(
+                spool_dir,
+                spool_key or path_builder(0),
+                data_lake,
+                self._spool_uploaded,
+                spool_max_bytes,
+            )
+            for manifest in self._spool.recover(self.uploaded_file_number):
+                self.file_number = manifest["file_number"] + 1
+                self.number_of_records += manifest["rows"]
+                if manifest["next_offset"] is not None:
+                    self.resume_offset = manifest["next_offset"]
+
+    def _reset_buffer(self):
+        self.buffered_next_offset = None
+        self.buffered_lines = list()
+        self.buffered_columns = {name: [] for name in DATA_LAKE_PARQUET_SCHEMA.names}
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+
+    def _is_full(self) -> bool:
+        if not self.target_file_bytes and not self.target_file_rows:
+            return True
+
+        return bool(
+            (self.target_file_bytes and self.buffered_bytes >= self.target_file_bytes)
+            or (self.target_file_rows and self.buffered_rows >= self.target_file_rows)
+        )
+
+    def add_page(self, page: List[Dict], next_offset: Optional[int] = None):
+        """
+        Buffer a page of API results, writing a
+        file once the buffer reaches its target size.
+
+        next_offset is the API offset following the
+        page and is reported once the page is uploaded.
+        Empty pages are ignored.
+        """
+        if not page:
+            return
+
+        start = time.perf_counter()
+        if self.output_format == "parquet":
+            columns = self.serializer.to_columns(page)
+            for column, values in columns.items():
+                self.buffered_columns[column].extend(values)
+            self.buffered_bytes += sum(len(data) for data in columns["data"])
+        else:
+            # one pass over the page, without an
+            # intermediate list of lines
+            to_line = self.serializer.to_line
+            append = self.buffered_lines.append
+            for record in page:
+                line = to_line(record)
+                append(line)
+                self.buffered_bytes += len(line) + 2
+
+        self.buffered_rows += len(page)
+        self.buffered_next_offset = next_offset
+        self.number_of_records += len(page)
+        self.serialize_seconds += time.perf_counter() - start
+
+        if self._is_full():
+            self.flush()
+
+    def _wait_for_pending_upload(self):
+        if self._pending_upload is not None:
+            start = time.perf_counter()
+            # re-raises any error from the upload thread
+            self._pending_upload.result()
+            self._pending_upload = None
+            self.upload_wait_seconds += time.perf_counter() - start
+
+    def _upload(
+        self, path: str, lines: List[str], columns: Dict[str, List],
+        rows: int, file_number: int, next_offset: Optional[int],
+    ):
+        start = time.perf_counter()
+        if self.output_format == "parquet":
+            gcs_path = self.data_lake.upload_parquet(
+                path, columns, DATA_LAKE_PARQUET_SCHEMA, self.parquet_row_group_size
+            )
+        else:
+            gcs_path = self.data_lake.upload_ndjson(
+                path,
+                drain(lines),
+                compression="gzip" if self.output_format == "json_gzip" else None,
+            )
+        self._record_upload(gcs_path, time.perf_counter() - start, rows, file_number, next_offset)
+
+    def _spool_uploaded(self, manifest: Dict, gcs_path: str, upload_seconds: float):
+        self._record_upload(
+            gcs_path,
+            upload_seconds,
+            manifest["rows"],
+            manifest["file_number"],
+            manifest["next_offset"],
+        )
+
+    def _record_upload(
+        self, gcs_path: str, upload_seconds: float, rows: int,
+        file_number: int, next_offset: Optional[int],
+    ):
+        with self._lock:
+            self.paths.append(gcs_path)
+            self.upload_seconds += upload_seconds
+            self.uploaded_records += rows
+            self.uploaded_file_number = file_number
+            if next_offset is not None:
+                self.uploaded_offset = next_offset
+        if self.on_upload is not None:
+            self.on_upload(self)
+
+    def flush(self):
+        """
+        Hand the buffered records to the upload thread
+        as the next file, once the previous one is done.
+        In spool mode the file is written to the spool.
+        """
+        if self._spool is not None:
+            self._flush_to_spool()
+            return
+
+        self._wait_for_pending_upload()
+        self._pending_upload = self._executor.submit(
+            self._upload,
+            self.path_builder(self.file_number),
+            self.buffered_lines,
+            self.buffered_columns,
+            self.buffered_rows,
+            self.file_number,
+            self.buffered_next_offset,
+        )
+        self.file_number += 1
+        self._reset_buffer()
+
+    def _flush_to_spool(self):
+        lines, columns = self.buffered_lines, self.buffered_columns
+        manifest = {
+            "path": self.path_builder(self.file_number),
+            "content_type": DATA_LAKE_CONTENT_TYPES[self.output_format],
+            "rows": self.buffered_rows,
+            "file_number": self.file_number,
+            "next_offset": self.buffered_next_offset,
+        }
+        self._reset_buffer()
+        self._spool.add(
+            manifest,
+            lambda file_name: write_data_lake_file(
+                file_name, self.output_format, lines, columns, self.parquet_row_group_size
+            ),
+        )
+        self.file_number += 1
+
+    def close(self) -> List[str]:
+        """
+        Write any buffered records, wait for the
+        last upload and return the uploaded paths.
+        No file is written for an endpoint without
+        records.
+        """
+        try:
+            if self.buffered_rows:
+                self.flush()
+            self._wait_for_pending_upload()
+            if self._spool is not None:
+                self._spool.close()
+            self.data_lake.sync()
+        finally:
+            self._executor.shutdown(wait=True)
+            if self._spool is not None:
+                self.upload_wait_seconds += self._spool.wait_seconds
+
+        return self.paths
+
+
+class PrefetchingPages:
+    """
+    Pull pages from an iterable on a background thread,
+    keeping up to max_queued pages ahead of the consumer.
+    The fetch thread blocks when the queue is full, so a
+    slow consumer applies back-pressure to the API.
+    """
+
+    _DONE = object()
+
+    def __init__(self, pages: Iterable, max_queued: int):
+        self.pages = pages
+        self.queue = queue.Queue(maxsize=max(max_queued, 1))
+        self.fetch_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._fetch, daemon=True)
+
+    def _put(self, item) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _fetch(self):
+        iterator = iter(self.pages)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    page = next(iterator)
+                except StopIteration:
+                    break
+                self.fetch_seconds += time.perf_counter() - start
+
+                start = time.perf_counter()
+                queued = self._put(page)
+                self.blocked_seconds += time.perf_counter() - start
+                if not queued:
+                    break
+        except BaseException as err:
+            self._put(err)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            self._put(self._DONE)
+
+    def __iter__(self):
+        self._thread.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # stop the fetch thread if the consumer stops early
+            self._stopped.set()
+            self._thread.join()
+
+
+class ExtractionProfiler:
+    """
+    Opt-in profiling of the extraction loop. cprofile
+    captures function timings of the calling thread as
+    a pstats file, tracemalloc captures the lines that
+    allocated the most memory as a text report.
+    """
+
+    PROFILE_MODES = ("cprofile", "tracemalloc")
+
+    def __init__(self, profile_mode: str, top: int = 50):
+        if profile_mode not in self.PROFILE_MODES:
+            raise ValueError(f"Unsupported profile mode {profile_mode}")
+
+        self.profile_mode = profile_mode
+        self.top = top
+        self.peak_memory_bytes = None
+        self._profiler = None
+
+    def start(self):
+        if self.profile_mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            tracemalloc.start(25)
+
+    def stop(self) -> bytes:
+        """
+        Stop profiling and return the report.
+        """
+        if self.profile_mode == "cprofile":
+            self._profiler.disable()
+            self._profiler.create_stats()
+            return marshal.dumps(self._profiler.stats)
+
+        snapshot = tracemalloc.take_snapshot()
+        self.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        report = io.StringIO()
+        report.write(f"Peak traced memory: {self.peak_memory_bytes} bytes\n")
+        for statistic in snapshot.statistics("traceback")[: self.top]:
+            report.write(f"\n{statistic}\n")
+            report.write("\n".join(statistic.traceback.format()))
+            report.write("\n")
+
+        return report.getvalue().encode("utf-8")
+
+    def summary(self, lines: int = 20) -> str:
+        """
+        Return the slowest functions by cumulative
+        time. Only available for cprofile.
+        """
+        stream = io.StringIO()
+        pstats.Stats(self._profiler, stream=stream).sort_stats("cumulative").print_stats(lines)
+
+        return stream.getvalue()
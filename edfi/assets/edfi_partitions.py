@@ -0,0 +1,122 @@
+import os
+from datetime import datetime
+
+from typing import Dict, List, Optional, Tuple
+
+from dagster import (
+    DagsterInstance,
+    DagsterRunStatus,
+    MultiPartitionsDefinition,
+    RunsFilter,
+    StaticPartitionsDefinition,
+)
+
+
+def get_env_list(name: str, default: str = "") -> List[str]:
+    """
+    Return the comma separated values of an
+    environment variable.
+    """
+    return [value.strip() for value in os.getenv(name, default).split(",") if value.strip()]
+
+
+# school years and tenants to extract. the extraction assets
+# are only partitioned when either variable is set so single
+# year deployments keep their unpartitioned job.
+EDFI_SCHOOL_YEARS = get_env_list("EDFI_SCHOOL_YEARS", os.getenv("CURRENT_SCHOOL_YEAR", ""))
+EDFI_TENANTS = get_env_list("EDFI_TENANTS")
+
+
+def build_edfi_partitions_def():
+    """
+    Return the partitions of the extraction assets:
+    school years, crossed with tenants when any are
+    configured. None when partitioning is disabled.
+    """
+    if os.getenv("EDFI_SCHOOL_YEARS") is None and not EDFI_TENANTS:
+        return None
+
+    school_years = StaticPartitionsDefinition(EDFI_SCHOOL_YEARS)
+    if not EDFI_TENANTS:
+        return school_years
+
+    return MultiPartitionsDefinition(
+        {
+            "school_year": school_years,
+            "tenant": StaticPartitionsDefinition(EDFI_TENANTS),
+        }
+    )
+
+
+edfi_partitions_def = build_edfi_partitions_def()
+
+
+def get_school_year_and_tenant(partition_key: str) -> Tuple[str, Optional[str]]:
+    """
+    Split an extraction partition key into its
+    school year and tenant.
+    """
+    if isinstance(edfi_partitions_def, MultiPartitionsDefinition):
+        keys = edfi_partitions_def.get_partition_key_from_str(partition_key).keys_by_dimension
+        return keys["school_year"], keys["tenant"]
+
+    return partition_key, None
+
+
+def get_partition_school_year_and_tenant(context, school_year) -> Tuple[str, Optional[str]]:
+    """
+    Return the school year and tenant a run extracts.
+    Unpartitioned runs use the configured school year
+    and the resource's instance.
+    """
+    if edfi_partitions_def is None or not context.has_partition_key:
+        return school_year, None
+
+    return get_school_year_and_tenant(context.partition_key)
+
+
+def get_partition_tags(partition_key: str) -> Dict[str, str]:
+    """
+    Return the run tags of an extraction partition.
+    The run coordinator limits concurrent runs per
+    edfi/tenant value to protect each ODS.
+    """
+    school_year, tenant = get_school_year_and_tenant(partition_key)
+
+    return {
+        "edfi/school_year": school_year,
+        "edfi/tenant": tenant or "default",
+    }
+
+
+def get_runs_awaiting_retry(
+    instance: DagsterInstance, job_name: str, updated_after: Optional[datetime] = None
+) -> List[str]:
+    """
+    Return the ids of failed runs of a job that
+    the run retry daemon will retry but has not
+    launched a retry for yet.
+    """
+    if not instance.run_retries_enabled:
+        return []
+
+    failed_runs = instance.get_runs(
+        RunsFilter(
+            job_name=job_name,
+            statuses=[DagsterRunStatus.FAILURE],
+            updated_after=updated_after,
+        )
+    )
+
+    run_ids = list()
+    for run in failed_runs:
+        max_retries = int(run.tags.get("dagster/max_retries", instance.run_retries_max_retries))
+        retry_number = int(run.tags.get("dagster/retry_number", 0))
+        if retry_number >= max_retries:
+            continue
+
+        retries = instance.get_runs_count(RunsFilter(tags={"dagster/parent_run_id": run.run_id}))
+        if not retries:
+            run_ids.append(run.run_id)
+
+    return run_ids
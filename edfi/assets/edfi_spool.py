@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import Callable, Dict, List
+
+from dagster import get_dagster_logger
+from tenacity import Retrying, stop_after_attempt, wait_random_exponential
+
+
+class DataLakeSpool:
+    """
+    Bounded on-disk staging area for data lake files of
+    one endpoint. Files are written to local disk and
+    uploaded in order by a background thread with
+    retries, so paging only waits on GCS once more than
+    max_bytes are waiting to be uploaded.
+
+    Each spooled file has a manifest written after the
+    file itself, so a restarted run can upload files
+    spooled before a crash instead of extracting them
+    again. Files are removed once uploaded, and the
+    spool's directory once every file is uploaded.
+    Directories left by attempts that were never
+    retried are removed after stale_after_seconds.
+    """
+
+    def __init__(
+        self,
+        spool_dir: str,
+        spool_key: str,
+        data_lake,
+        on_uploaded: Callable[[Dict, str, float], None],
+        max_bytes: int = 1024 * 1024 * 1024,
+        upload_max_attempts: int = 8,
+        stale_after_seconds: float = 7 * 24 * 60 * 60,
+    ):
+        self.directory = os.path.join(
+            spool_dir, hashlib.sha256(spool_key.encode("utf-8")).hexdigest()[:32]
+        )
+        self.log = get_dagster_logger()
+        self._remove_stale_directories(spool_dir, stale_after_seconds)
+        os.makedirs(self.directory, exist_ok=True)
+        self.data_lake = data_lake
+        self.on_uploaded = on_uploaded
+        self.max_bytes = max_bytes
+        self.upload_max_attempts = upload_max_attempts
+        self.pending_bytes = 0
+        self.wait_seconds = 0.0
+        self._error = None
+        self._condition = threading.Condition()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._upload_files, daemon=True)
+        self._thread.start()
+
+    def _remove_stale_directories(self, spool_dir: str, stale_after_seconds: float):
+        """
+        Remove spool directories of other spools that
+        were not modified for stale_after_seconds.
+        """
+        if not os.path.isdir(spool_dir):
+            return
+
+        cutoff = time.time() - stale_after_seconds
+        for entry in os.scandir(spool_dir):
+            if not entry.is_dir() or entry.path == self.directory:
+                continue
+            try:
+                modified = max(
+                    [entry.stat().st_mtime]
+                    + [
+                        os.path.getmtime(os.path.join(entry.path, name))
+                        for name in os.listdir(entry.path)
+                    ]
+                )
+            except OSError:
+                # removed or written to while scanning
+                continue
+            if modified < cutoff:
+                self.log.info(f"Removing stale spool directory {entry.path}")
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _file_names(self, file_number: int):
+        data_file = os.path.join(self.directory, f"{file_number:09}.data")
+        return data_file, f"{data_file}.json"
+
+    @staticmethod
+    def _write_atomically(file_name: str, write_file: Callable[[str], None]):
+        temp_file = f"{file_name}.tmp"
+        write_file(temp_file)
+        with open(temp_file, "rb") as spooled_file:
+            os.fsync(spooled_file.fileno())
+        os.replace(temp_file, file_name)
+
+    def _remove(self, file_number: int):
+        for file_name in self._file_names(file_number):
+            try:
+                os.remove(file_name)
+            except FileNotFoundError:
+                pass
+
+    def recover(self, uploaded_file_number: int) -> List[Dict]:
+        """
+        Queue files spooled by an earlier attempt that
+        directly follow the last uploaded file and return
+        their manifests. Any other leftovers are removed.
+        """
+        manifests = dict()
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(".data.json"):
+                with open(os.path.join(self.directory, file_name)) as manifest_file:
+                    manifest = json.load(manifest_file)
+                manifests[manifest["file_number"]] = manifest
+            elif file_name.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, file_name))
+
+        recovered = list()
+        file_number = uploaded_file_number + 1
+        while file_number in manifests:
+            recovered.append(manifests.pop(file_number))
+            file_number += 1
+
+        for stale_file_number in manifests:
+            self._remove(stale_file_number)
+        for manifest in recovered:
+            self._enqueue(manifest)
+
+        if recovered:
+            self.log.info(f"Recovered {len(recovered)} spooled files to upload")
+
+        return recovered
+
+    def _enqueue(self, manifest: Dict):
+        with self._condition:
+            self.pending_bytes += manifest["bytes"]
+        self._queue.put(manifest)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def add(self, manifest: Dict, write_file: Callable[[str], None]):
+        """
+        Write a file to the spool with write_file, which
+        is passed a local file name, and queue it for
+        upload. Blocks while the spool is full.
+        """
+        start = time.perf_counter()
+        with self._condition:
+            while self.pending_bytes >= self.max_bytes and self._error is None:
+                self._condition.wait()
+        self.wait_seconds += time.perf_counter() - start
+        self._raise_error()
+
+        data_file, manifest_file = self._file_names(manifest["file_number"])
+        self._write_atomically(data_file, write_file)
+        manifest = {**manifest, "bytes": os.path.getsize(data_file)}
+
+        def write_manifest(file_name):
+            with open(file_name, "w") as manifest_temp_file:
+                json.dump(manifest, manifest_temp_file)
+
+        self._write_atomically(manifest_file, write_manifest)
+        self._enqueue(manifest)
+
+    def _upload_files(self):
+        while True:
+            manifest = self._queue.get()
+            if manifest is None:
+                return
+
+            try:
+                data_file, _ = self._file_names(manifest["file_number"])
+                start = time.perf_counter()
+                for attempt in Retrying(
+                    stop=stop_after_attempt(self.upload_max_attempts),
+                    wait=wait_random_exponential(multiplier=1, max=60),
+                    reraise=True,
+                ):
+                    with attempt:
+                        gcs_path = self.data_lake.upload_file(
+                            manifest["path"], data_file, manifest["content_type"]
+                        )
+                upload_seconds = time.perf_counter() - start
+                self.on_uploaded(manifest, gcs_path, upload_seconds)
+                self._remove(manifest["file_number"])
+            except BaseException as err:
+                # spooled files are kept for the next attempt
+                self.log.error(f"Failed to upload spooled file {manifest['path']}: {err}")
+                with self._condition:
+                    self._error = err
+                    self._condition.notify_all()
+                return
+
+            with self._condition:
+                self.pending_bytes -= manifest["bytes"]
+                self._condition.notify_all()
+
+    def close(self):
+        """
+        Wait for every spooled file to be uploaded,
+        raising any upload error, and remove the
+        spool's directory.
+        """
+        start = time.perf_counter()
+        self._queue.put(None)
+        self._thread.join()
+        self.wait_seconds += time.perf_counter() - start
+        self._raise_error()
+        # every file was uploaded and removed. only
+        # leftover temp files can remain.
+        shutil.rmtree(self.directory, ignore_errors=True)
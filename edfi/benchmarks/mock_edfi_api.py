@@ -0,0 +1,207 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+import json
+import re
+import threading
+import time
+import uuid
+
+
+class MockEdFiApi:
+    """
+    Local stand-in for an Ed-Fi ODS API used by the
+    benchmarks. Every resource holds row_count records
+    of roughly record_size bytes, with change versions
+    1 to row_count. Deletes endpoints hold delete_count
+    records.
+
+    Every fail_401_every-th and fail_429_every-th data
+    request is rejected to exercise token refresh and
+    throttling. Set either to 0 to disable it.
+    """
+
+    def __init__(
+        self,
+        row_count: int = 10000,
+        delete_count: int = 0,
+        record_size: int = 1024,
+        page_latency: float = 0.0,
+        fail_401_every: int = 0,
+        fail_429_every: int = 0,
+        retry_after: float = 0.0,
+        total_count: bool = True,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.row_count = row_count
+        self.delete_count = delete_count
+        self.record_size = record_size
+        self.page_latency = page_latency
+        self.fail_401_every = fail_401_every
+        self.fail_429_every = fail_429_every
+        self.retry_after = retry_after
+        self.total_count = total_count
+        self.request_counts = dict()
+        self.lock = threading.Lock()
+        self._records = dict()
+        self._server = ThreadingHTTPServer((host, port), self._build_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockEdFiApi":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count_request(self, kind: str) -> int:
+        with self.lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+            return self.request_counts[kind]
+
+    def reset_request_counts(self):
+        with self.lock:
+            self.request_counts = dict()
+
+    def get_records(self, resource: str):
+        """
+        Build a resource's records once and reuse
+        them so serving pages stays cheap.
+        """
+        with self.lock:
+            if resource not in self._records:
+                if resource.endswith("/deletes"):
+                    self._records[resource] = [
+                        {"Id": str(uuid.uuid4()), "ChangeVersion": index + 1}
+                        for index in range(self.delete_count)
+                    ]
+                else:
+                    padding = "x" * max(self.record_size - 150, 0)
+                    self._records[resource] = [
+                        {
+                            "id": uuid.uuid4().hex,
+                            "resource": resource,
+                            "padding": padding,
+                            "_etag": str(index),
+                            "changeVersion": index + 1,
+                        }
+                        for index in range(self.row_count)
+                    ]
+
+            return self._records[resource]
+
+    def get_page(self, resource: str, query: Dict) -> Dict:
+        records = self.get_records(resource)
+        min_change_version = int(query.get("minChangeVersion", ["-1"])[0])
+        max_change_version = int(query.get("maxChangeVersion", ["-1"])[0])
+        if min_change_version > -1 and max_change_version > -1:
+            # change versions are 1 to len(records) in order
+            records = records[max(min_change_version, 1) - 1 : max(max_change_version, 0)]
+
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", ["25"])[0])
+
+        return {
+            "page": records[offset : offset + limit],
+            "total_count": len(records),
+        }
+
+    def _build_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body, headers: Optional[Dict] = None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or dict()).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(length)
+                if self.path.startswith("/oauth/token"):
+                    api.count_request("token")
+                    self._send_json(
+                        200, {"access_token": uuid.uuid4().hex, "expires_in": 1800}
+                    )
+                    return
+
+                api.count_request("post")
+                self._send_json(
+                    201, {}, {"Location": f"{api.base_url}{self.path}/{uuid.uuid4().hex}"}
+                )
+
+            def do_DELETE(self):
+                api.count_request("delete")
+                self.send_response(204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+
+                if url.path.endswith("/availableChangeVersions"):
+                    api.count_request("change_versions")
+                    self._send_json(
+                        200,
+                        {
+                            "OldestChangeVersion": 0,
+                            "NewestChangeVersion": max(api.row_count, api.delete_count),
+                        },
+                    )
+                    return
+
+                match = re.match(r"^/data/v3(?:/\d{4})?(/.+)$", url.path)
+                if match is None:
+                    self._send_json(404, {"message": "Not found"})
+                    return
+
+                request_number = api.count_request("data")
+                if api.fail_401_every and request_number % api.fail_401_every == 0:
+                    api.count_request("rejected_401")
+                    self._send_json(401, {"message": "Invalid token"})
+                    return
+                if api.fail_429_every and request_number % api.fail_429_every == 0:
+                    api.count_request("rejected_429")
+                    self._send_json(
+                        429, {"message": "Too many requests"},
+                        {"Retry-After": str(api.retry_after)},
+                    )
+                    return
+
+                if api.page_latency:
+                    time.sleep(api.page_latency)
+
+                page = api.get_page(match.group(1), query)
+                headers = dict()
+                if api.total_count and query.get("totalCount") == ["true"]:
+                    headers["Total-Count"] = str(page["total_count"])
+                self._send_json(200, page["page"], headers)
+
+        return Handler
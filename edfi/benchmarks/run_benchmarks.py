@@ -0,0 +1,223 @@
+"""
+Offline benchmarks of the Ed-Fi extraction path.
+
+Runs EdFiApiClient.get_data, GcsClient.upload_json and
+the extract_and_load asset against a local mock Ed-Fi
+API and the local storage backend, and reports
+throughput, peak traced memory and request counts.
+
+Run from the edfi folder:
+
+    python -m benchmarks.run_benchmarks --rows 50000 --concurrency 4
+
+Pass --output to save the results and --baseline to
+fail when throughput drops by more than
+--max-regression compared to saved results.
+"""
+from typing import Callable, Dict
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from dagster import materialize
+
+from assets.edfi_api import change_query_versions, edfi_assets
+from benchmarks.mock_edfi_api import MockEdFiApi
+from resources.edfi_api_resource import EdFiApiClient, EdFiApiResource
+from resources.gcs_resource import GcsClient, GcsResource
+
+
+SCHOOL_YEAR = 2024
+
+
+def measure(name: str, run: Callable[[], int], api: MockEdFiApi) -> Dict:
+    """
+    Run a benchmark and return its timing, peak traced
+    memory and the requests it made. run returns the
+    number of rows it processed.
+    """
+    api.reset_request_counts()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        rows = run()
+        seconds = time.perf_counter() - start
+        peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "benchmark": name,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / max(seconds, 1e-9),
+        "peak_memory_bytes": peak_memory_bytes,
+        "requests": dict(api.request_counts),
+    }
+
+
+def benchmark_get_data(args, api: MockEdFiApi) -> int:
+    client = EdFiApiClient(
+        api.base_url,
+        "benchmark",
+        "benchmark",
+        args.page_limit,
+        "YearSpecific",
+        "5.3",
+        api_concurrency=args.concurrency,
+        api_max_requests_per_second=args.requests_per_second,
+    )
+    rows = 0
+    for page in client.get_data("/ed-fi/students", SCHOOL_YEAR, -1, -1):
+        rows += len(page)
+
+    return rows
+
+
+def benchmark_upload_json(args, api: MockEdFiApi, root_dir: str) -> int:
+    records = api.get_records("/ed-fi/students")
+    data_lake = GcsClient(
+        "benchmark",
+        storage_backend="local",
+        local_storage_root=root_dir,
+        fsync_batch_size=args.fsync_batch_size,
+    )
+    data_lake.upload_json("benchmark/upload_json/students.json", records)
+
+    return len(records)
+
+
+def benchmark_extract_and_load(args, api: MockEdFiApi, root_dir: str) -> int:
+    asset = next(
+        asset for asset in edfi_assets if asset.key.path[-1] == args.asset
+    )
+    op_config = {
+        "base_url": api.base_url,
+        "api_key": "benchmark",
+        "api_secret": "benchmark",
+        "api_page_limit": args.page_limit,
+        "school_year": str(SCHOOL_YEAR),
+        "staging_gcs_bucket": "benchmark",
+        "use_change_queries": args.use_change_queries,
+    }
+    result = materialize(
+        [change_query_versions, asset],
+        resources={
+            "edfi_api_client": EdFiApiResource(
+                base_url=api.base_url,
+                api_key="benchmark",
+                api_secret="benchmark",
+                api_page_limit=args.page_limit,
+                api_mode="YearSpecific",
+                api_version="5.3",
+                api_concurrency=args.concurrency,
+                api_max_requests_per_second=args.requests_per_second,
+            ),
+            "data_lake": GcsResource(
+                staging_gcs_bucket="benchmark",
+                storage_backend="local",
+                local_storage_root=root_dir,
+                fsync_batch_size=args.fsync_batch_size,
+            ),
+        },
+        run_config={
+            "ops": {
+                "staging__change_query_versions": {"config": op_config},
+                f"staging__{args.asset}": {
+                    "config": {**op_config, "api_concurrency": args.concurrency}
+                },
+            }
+        },
+    )
+    metadata = result.asset_materializations_for_node(f"staging__{args.asset}")[0].metadata
+
+    return metadata["Changed records"].value + metadata["Deleted records"].value
+
+
+def compare_to_baseline(results, baseline_path: str, max_regression: float) -> bool:
+    """
+    Return False if any benchmark's throughput fell by
+    more than max_regression compared to the baseline.
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = {result["benchmark"]: result for result in json.load(baseline_file)}
+
+    passed = True
+    for result in results:
+        previous = baseline.get(result["benchmark"])
+        if previous is None:
+            continue
+        change = result["rows_per_second"] / previous["rows_per_second"] - 1
+        print(f"{result['benchmark']}: {change:+.1%} rows/s compared to baseline")
+        if change < -max_regression:
+            passed = False
+
+    return passed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--deletes", type=int, default=0)
+    parser.add_argument("--record-size", type=int, default=1024)
+    parser.add_argument("--page-limit", type=int, default=2500)
+    parser.add_argument("--page-latency", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests-per-second", type=float, default=1000.0)
+    parser.add_argument("--fail-401-every", type=int, default=0)
+    parser.add_argument("--fail-429-every", type=int, default=0)
+    parser.add_argument("--fsync-batch-size", type=int, default=100)
+    parser.add_argument("--asset", default="base_edfi_students")
+    parser.add_argument("--use-change-queries", action="store_true")
+    parser.add_argument(
+        "--benchmarks", nargs="+", default=["get_data", "upload_json", "extract_and_load"]
+    )
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    api = MockEdFiApi(
+        row_count=args.rows,
+        delete_count=args.deletes,
+        record_size=args.record_size,
+        page_latency=args.page_latency,
+        fail_401_every=args.fail_401_every,
+        fail_429_every=args.fail_429_every,
+    )
+    results = list()
+    with api, tempfile.TemporaryDirectory() as root_dir:
+        benchmarks = {
+            "get_data": lambda: benchmark_get_data(args, api),
+            "upload_json": lambda: benchmark_upload_json(args, api, root_dir),
+            "extract_and_load": lambda: benchmark_extract_and_load(args, api, root_dir),
+        }
+        # build the mock records outside of the measurements
+        api.get_records("/ed-fi/students")
+        for name in args.benchmarks:
+            results.append(measure(name, benchmarks[name], api))
+
+    for result in results:
+        print(
+            f"{result['benchmark']:<18} {result['rows']:>9} rows "
+            f"{result['seconds']:>8.2f}s {result['rows_per_second']:>10.0f} rows/s "
+            f"{result['peak_memory_bytes'] / 1024 / 1024:>8.1f} MiB peak "
+            f"requests {result['requests']}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline and not compare_to_baseline(results, args.baseline, args.max_regression):
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
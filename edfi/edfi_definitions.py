@@ -1,23 +1,39 @@
 import os
+from datetime import datetime, timezone
 
 from dagster import (
     AssetSelection,
+    DagsterRunStatus,
     define_asset_job,
     DefaultScheduleStatus,
+    DefaultSensorStatus,
     Definitions,
     EnvVar,
     fs_io_manager,
     make_values_resource,
     multiprocess_executor,
+    PartitionedConfig,
     repository,
+    RunRequest,
+    RunsFilter,
+    run_status_sensor,
+    schedule,
     ScheduleDefinition,
+    SkipReason,
     with_resources,
 )
 from dagster_dbt import load_assets_from_dbt_project, DbtCliResource
 from dagster_gcp.gcs.resources import gcs_resource
 
 from assets.edfi_api import change_query_versions, edfi_assets
-from assets.dbt_assets import edfi_dbt_assets
+from assets.edfi_api_async import extract_and_load_all
+from assets.dbt_assets import CHANGED_SINCE_TAG, edfi_dbt_assets
+from assets.edfi_partitions import (
+    edfi_partitions_def,
+    get_partition_tags,
+    get_runs_awaiting_retry,
+    get_school_year_and_tenant,
+)
 
 from resources.edfi_api_resource import EdFiApiClient, EdFiApiResource
 from resources.gcs_resource import GcsClient, GcsResource
@@ -29,41 +45,182 @@ from resources.bq_resource import BigQueryClient
 #     tags={"dagster/max_retries": 3}
 # )
 
-edfi_api_refresh_job = define_asset_job(
-    name=f"edfi_api_job_{os.getenv('CURRENT_SCHOOL_YEAR')}", 
-    selection=AssetSelection.groups("source") | AssetSelection.groups("edfi_staging") | AssetSelection.groups("edfi_amt"), 
-    tags={"dagster/max_retries": 3}
-)
+# "async" extracts every endpoint from one event loop in a single
+# step instead of running one step per endpoint asset
+if os.getenv("EDFI_EXTRACTION_ENGINE", "threaded") == "async":
+    edfi_extract_assets = [extract_and_load_all]
+else:
+    edfi_extract_assets = edfi_assets
 
-edfi_full_refresh_schedule = ScheduleDefinition(
-    name="edfi_full_refresh",
-    job=edfi_api_refresh_job,
-    cron_schedule="0 6 * * 6",
-    run_config={
-        "ops": {
-            "staging__change_query_versions": {"config": {"use_change_queries": False}}
-        }
-    },
-    default_status=DefaultScheduleStatus.RUNNING,
-)
+if edfi_partitions_def is None:
+    edfi_api_refresh_job = define_asset_job(
+        name=f"edfi_api_job_{os.getenv('CURRENT_SCHOOL_YEAR')}", 
+        selection=AssetSelection.groups("source") | AssetSelection.groups("edfi_staging") | AssetSelection.groups("edfi_amt"), 
+        tags={"dagster/max_retries": 3}
+    )
 
-edfi_delta_refresh_schedule = ScheduleDefinition(
-    name="edfi_delta_refresh",
-    job=edfi_api_refresh_job,
-    cron_schedule="0 6 * * 7,1-5",
-    run_config={
-        "ops": {
-            "staging__change_query_versions": {"config": {"use_change_queries": True}}
-        }
-    },
-    default_status=DefaultScheduleStatus.RUNNING,
-)
+    edfi_full_refresh_schedule = ScheduleDefinition(
+        name="edfi_full_refresh",
+        job=edfi_api_refresh_job,
+        cron_schedule="0 6 * * 6",
+        run_config={
+            "ops": {
+                "staging__change_query_versions": {"config": {"use_change_queries": False}}
+            }
+        },
+        default_status=DefaultScheduleStatus.RUNNING,
+    )
+
+    edfi_delta_refresh_schedule = ScheduleDefinition(
+        name="edfi_delta_refresh",
+        job=edfi_api_refresh_job,
+        cron_schedule="0 6 * * 7,1-5",
+        run_config={
+            "ops": {
+                "staging__change_query_versions": {"config": {"use_change_queries": True}}
+            }
+        },
+        default_status=DefaultScheduleStatus.RUNNING,
+    )
+
+    edfi_jobs = [edfi_api_refresh_job]
+    edfi_sensors = []
+else:
+    # the extraction assets are partitioned by school year and
+    # tenant while the dbt assets are not, so they run as two
+    # jobs. each partition run is tagged with its tenant so the
+    # run coordinator can limit concurrent runs per ODS.
+    edfi_api_refresh_job = define_asset_job(
+        name="edfi_api_partitioned_job",
+        selection=AssetSelection.groups("source"),
+        config=PartitionedConfig(
+            partitions_def=edfi_partitions_def,
+            run_config_for_partition_key_fn=lambda partition_key: {},
+            tags_for_partition_key_fn=get_partition_tags,
+        ),
+        tags={"dagster/max_retries": 3}
+    )
+
+    edfi_dbt_job = define_asset_job(
+        name="edfi_dbt_job",
+        selection=AssetSelection.groups("edfi_staging") | AssetSelection.groups("edfi_amt"),
+        tags={"dagster/max_retries": 3, "edfi/job": "dbt"}
+    )
+
+    def get_scheduled_partition_keys():
+        """
+        Return the partitions the schedules refresh:
+        every tenant's current school year, or every
+        partition if the current year is not one.
+        """
+        partition_keys = edfi_partitions_def.get_partition_keys()
+        current_year_keys = [
+            partition_key for partition_key in partition_keys
+            if get_school_year_and_tenant(partition_key)[0] == os.getenv("CURRENT_SCHOOL_YEAR")
+        ]
+
+        return current_year_keys or partition_keys
+
+    def build_refresh_schedule(name, cron_schedule, use_change_queries):
+        @schedule(
+            name=name,
+            job=edfi_api_refresh_job,
+            cron_schedule=cron_schedule,
+            default_status=DefaultScheduleStatus.RUNNING,
+        )
+        def refresh_schedule(context):
+            for partition_key in get_scheduled_partition_keys():
+                yield RunRequest(
+                    run_key=f"{name}_{context.scheduled_execution_time}_{partition_key}",
+                    partition_key=partition_key,
+                    run_config={
+                        "ops": {
+                            "staging__change_query_versions": {
+                                "config": {"use_change_queries": use_change_queries}
+                            }
+                        }
+                    },
+                )
+
+        return refresh_schedule
+
+    edfi_full_refresh_schedule = build_refresh_schedule("edfi_full_refresh", "0 6 * * 6", False)
+    edfi_delta_refresh_schedule = build_refresh_schedule("edfi_delta_refresh", "0 6 * * 7,1-5", True)
+
+    def build_dbt_after_extract_sensor(run_status):
+        @run_status_sensor(
+            name=f"edfi_dbt_after_extract_{run_status.value.lower()}_sensor",
+            run_status=run_status,
+            monitored_jobs=[edfi_api_refresh_job],
+            request_job=edfi_dbt_job,
+            default_status=DefaultSensorStatus.RUNNING,
+        )
+        def dbt_after_extract_sensor(context):
+            """
+            Run dbt once the last pending extraction
+            partition run has finished and no failed
+            partition is awaiting a retry, rather than
+            once per partition. dbt picks up sources
+            materialized since its last successful run.
+            """
+            tags = {}
+            updated_after = None
+            dbt_runs = context.instance.get_run_records(
+                RunsFilter(job_name=edfi_dbt_job.name, statuses=[DagsterRunStatus.SUCCESS]),
+                limit=1,
+            )
+            if dbt_runs:
+                changed_since = dbt_runs[0].start_time or dbt_runs[0].create_timestamp.timestamp()
+                tags[CHANGED_SINCE_TAG] = str(changed_since)
+                updated_after = datetime.fromtimestamp(changed_since, tz=timezone.utc)
+
+            pending_runs = context.instance.get_runs_count(
+                RunsFilter(
+                    job_name=edfi_api_refresh_job.name,
+                    statuses=[
+                        DagsterRunStatus.QUEUED,
+                        DagsterRunStatus.NOT_STARTED,
+                        DagsterRunStatus.STARTING,
+                        DagsterRunStatus.STARTED,
+                    ],
+                )
+            )
+            if pending_runs:
+                return SkipReason(f"{pending_runs} extraction runs are still pending")
+
+            # a failed partition is retried as a new run that
+            # may not be queued yet. dbt waits for it rather
+            # than merging a partial extract.
+            awaiting_retry = get_runs_awaiting_retry(
+                context.instance, edfi_api_refresh_job.name, updated_after
+            )
+            if awaiting_retry:
+                return SkipReason(f"{len(awaiting_retry)} extraction runs are awaiting a retry")
+
+            return RunRequest(run_key=context.dagster_run.run_id, tags=tags)
+
+        return dbt_after_extract_sensor
+
+    # a partition run that fails or is canceled can be the
+    # last one to finish, so every terminal status is watched
+    edfi_dbt_after_extract_sensors = [
+        build_dbt_after_extract_sensor(run_status)
+        for run_status in [
+            DagsterRunStatus.SUCCESS,
+            DagsterRunStatus.FAILURE,
+            DagsterRunStatus.CANCELED,
+        ]
+    ]
+
+    edfi_jobs = [edfi_api_refresh_job, edfi_dbt_job]
+    edfi_sensors = edfi_dbt_after_extract_sensors
 
 
 EdFi_Current_School_Year = Definitions(
-    assets=[change_query_versions] + edfi_assets + [edfi_dbt_assets],
-    jobs=[edfi_api_refresh_job], # + [dbt_refresh_job],
+    assets=[change_query_versions] + edfi_extract_assets + [edfi_dbt_assets],
+    jobs=edfi_jobs, # + [dbt_refresh_job],
     schedules=[edfi_full_refresh_schedule] + [edfi_delta_refresh_schedule],
+    sensors=edfi_sensors,
     resources= {
         "gcs": gcs_resource,
         "io_manager": fs_io_manager,
@@ -82,6 +239,10 @@ EdFi_Current_School_Year = Definitions(
             api_page_limit = 2500,
             api_mode = "YearSpecific", # DistrictSpecific, SharedInstance, YearSpecific
             api_version = "5.3",
+            api_concurrency = 4,
+            async_max_concurrency = 16,
+            async_requests_per_second = 20.0,
+            token_cache_path = os.getenv("EDFI_TOKEN_CACHE_PATH", "/tmp/edfi_api_token_cache.json"),
         ),
         "globals": make_values_resource(school_year=int).configured(
             {
@@ -1,15 +1,31 @@
 import json
 import uuid
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
 
 from dagster import get_dagster_logger
 from dagster import resource, ConfigurableResource, InitResourceContext
-from google.cloud import bigquery
+from google.cloud import bigquery, exceptions
+from pydantic import PrivateAttr
 import pandas as pd
+import pyarrow as pa
+
+
+# bigquery source format of each data lake output format.
+# gzip compressed files are detected by bigquery.
+SOURCE_FORMATS = {
+    "json": bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+    "json_gzip": bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+    "parquet": bigquery.SourceFormat.PARQUET,
+}
 
 
 class BigQueryClient:
-    """Class for loading data into BigQuery"""
+    """
+    Class for loading data into BigQuery. The
+    client is kept open between calls. Call close
+    once it is no longer needed.
+    """
 
     def __init__(self, dataset):
         self.dataset = dataset
@@ -17,6 +33,7 @@ class BigQueryClient:
         self._create_dataset()
         self.dataset_ref = bigquery.DatasetReference(self.client.project, self.dataset)
         self.log = get_dagster_logger()
+        self._read_client = None
 
 
     def _create_dataset(self):
@@ -44,29 +61,164 @@ class BigQueryClient:
             df, table_ref, job_config=job_config
         )
         job.result()  # waits for the job to complete.
-        self.client.close()
 
         return f"Created table {self.client.project}.{self.dataset}.{table_name}"
 
 
-    def download_table(self, table_reference: str) -> pd.DataFrame:
+    def load_from_uris(
+        self,
+        table_name: str,
+        source_uris: List[str],
+        source_format: str = "json",
+        schema: Optional[List] = None,
+        write_disposition: str = "WRITE_APPEND",
+        hive_partition_uri_prefix: Optional[str] = None,
+    ) -> int:
+        """
+        Load data lake files straight from GCS into
+        a BigQuery table without passing them through
+        pandas, and return the number of rows loaded.
+
+        source_format is a data lake output format.
+        The schema is detected when none is given.
+        """
+        job_config = bigquery.LoadJobConfig(
+            source_format=SOURCE_FORMATS[source_format],
+            write_disposition=write_disposition,
+            schema=schema,
+            autodetect=schema is None,
+        )
+        if hive_partition_uri_prefix:
+            hive_partitioning = bigquery.HivePartitioningOptions()
+            hive_partitioning.mode = "AUTO"
+            hive_partitioning.source_uri_prefix = hive_partition_uri_prefix
+            job_config.hive_partitioning = hive_partitioning
+
+        job = self.client.load_table_from_uri(
+            source_uris, self.dataset_ref.table(table_name), job_config=job_config
+        )
+        job.result()  # waits for the job to complete.
+        self.log.info(
+            f"Loaded {job.output_rows} rows from {len(source_uris)} uris into "
+            f"{self.client.project}.{self.dataset}.{table_name}"
+        )
+
+        return job.output_rows
+
+
+    @property
+    def read_client(self):
+        """
+        BigQuery Storage Read API client,
+        created on first use.
+        """
+        if self._read_client is None:
+            from google.cloud import bigquery_storage
+
+            self._read_client = bigquery_storage.BigQueryReadClient()
+
+        return self._read_client
+
+
+    def read_table_arrow(
+        self,
+        table_reference: str,
+        columns: Optional[List[str]] = None,
+        row_filter: Optional[str] = None,
+        max_stream_count: int = 4,
+    ) -> pa.Table:
+        """
+        Read a table as Arrow with the Storage Read API.
+        Only the passed in columns and the rows matching
+        row_filter, a SQL where clause, are read. Streams
+        are read in parallel.
+
+        table_reference is dataset.table in the
+        client's project.
+        """
+        from google.cloud import bigquery_storage
+
+        dataset, table = table_reference.split(".")
+        requested_session = bigquery_storage.types.ReadSession(
+            table=f"projects/{self.client.project}/datasets/{dataset}/tables/{table}",
+            data_format=bigquery_storage.types.DataFormat.ARROW,
+            read_options=bigquery_storage.types.ReadSession.TableReadOptions(
+                selected_fields=columns or [],
+                row_restriction=row_filter or "",
+            ),
+        )
+        session = self.read_client.create_read_session(
+            parent=f"projects/{self.client.project}",
+            read_session=requested_session,
+            max_stream_count=max_stream_count,
+        )
+        if not session.streams:
+            # no rows matched
+            return session_schema_to_empty_table(session)
+
+        def read_stream(stream):
+            return self.read_client.read_rows(stream.name).to_arrow(session)
+
+        with ThreadPoolExecutor(max_workers=len(session.streams)) as executor:
+            tables = list(executor.map(read_stream, session.streams))
+
+        return pa.concat_tables(tables)
+
+
+    def download_table(
+        self,
+        table_reference: str,
+        columns: Optional[List[str]] = None,
+        row_filter: Optional[str] = None,
+    ) -> pd.DataFrame:
         """
         Download table and return the resulting QueryJob.
         Returns empty dataframe if table not found or
         table has no rows.
+
+        Reads with the Storage Read API, limited to
+        the passed in columns and row_filter. Views,
+        which the Storage Read API cannot read, and
+        Storage Read API errors fall back to a query.
         """
         try:
-            query_job = self.client.query(f"SELECT * FROM {self.client.project}.{table_reference}")
-            df = query_job.to_dataframe()
-        except:
-            self.log.warn("Failed to download table. Returning empty dataframe.")
-            df = pd.DataFrame()
+            table = self.client.get_table(f"{self.client.project}.{table_reference}")
+        except exceptions.NotFound:
+            self.log.warn("Table not found. Returning empty dataframe.")
+            return pd.DataFrame()
+
+        if table.table_type == "TABLE":
+            try:
+                df = self.read_table_arrow(table_reference, columns, row_filter).to_pandas()
+            except (ImportError, exceptions.GoogleCloudError) as err:
+                # missing google-cloud-bigquery-storage
+                # or missing read session permissions
+                self.log.warn(f"Storage Read API failed: {err}. Falling back to a query.")
+                df = self._query_table(table_reference, columns, row_filter)
+        else:
+            df = self._query_table(table_reference, columns, row_filter)
 
         self.log.info(f"Downloaded {len(df)} rows from table {self.client.project}.{table_reference}")
 
         return df
 
 
+    def _query_table(
+        self,
+        table_reference: str,
+        columns: Optional[List[str]] = None,
+        row_filter: Optional[str] = None,
+    ) -> pd.DataFrame:
+        query = (
+            f"SELECT {', '.join(columns) if columns else '*'} "
+            f"FROM {self.client.project}.{table_reference}"
+        )
+        if row_filter:
+            query = f"{query} WHERE {row_filter}"
+
+        return self.client.query(query).to_dataframe()
+
+
     def run_query(self, query: str):
         """
         Run SQL query and return the resulting QueryJob.
@@ -76,11 +228,34 @@ class BigQueryClient:
         )
 
 
+    def close(self):
+        """
+        Close the BigQuery client.
+        """
+        self.client.close()
+
+
+def session_schema_to_empty_table(session) -> pa.Table:
+    """
+    Return an empty Arrow table with the schema
+    of a Storage Read API read session.
+    """
+    schema = pa.ipc.read_schema(pa.py_buffer(session.arrow_schema.serialized_schema))
+
+    return schema.empty_table()
+
+
 class BigQueryResource(ConfigurableResource):
     data: str
 
+    _bq_client: Optional[BigQueryClient] = PrivateAttr(default=None)
+
     def init_bq_resource(self) -> BigQueryClient:
-        return BigQueryClient(self.data)
+        # reuse one client for every call in this process
+        if self._bq_client is None:
+            self._bq_client = BigQueryClient(self.data)
+
+        return self._bq_client
 
 
 
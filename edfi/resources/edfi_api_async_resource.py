@@ -0,0 +1,248 @@
+from typing import List, Dict, Optional, Tuple
+
+import asyncio
+import threading
+import time
+
+import aiohttp
+from dagster import get_dagster_logger
+from tenacity import retry
+
+from resources.edfi_api_resource import EdFiApiClient
+from resources.edfi_retry import (
+    get_retry_after,
+    get_shared_rate_limiter,
+    get_shared_retry_budget,
+    record_retry,
+    should_retry,
+    stop_after_max_attempts,
+    wait_for_retry,
+)
+from resources.edfi_token_cache import get_token_cache, request_access_token
+
+
+# https://api.ed-fi.org/v3.2.0/docs/index.html?urls.primaryName=Resources#/
+class AsyncEdFiApiClient:
+    """
+    Class for interacting with an Ed-Fi API from
+    a single asyncio event loop. All requests made by
+    the client share one connection pool, a global
+    concurrency limit and a per-host adaptive rate limit.
+    """
+
+    def __init__(
+        self, base_url, api_key, api_secret, api_page_limit, api_mode, api_version,
+        api_concurrency=1, max_concurrency=16, requests_per_second=20.0,
+        api_connect_timeout=10.0, api_read_timeout=300.0, token_cache_path=None,
+        api_max_attempts=8, api_min_requests_per_second=1.0, api_latency_target_seconds=None,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.api_page_limit = api_page_limit
+        self.api_mode = api_mode
+        self.api_version = api_version
+        self.api_concurrency = api_concurrency
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.token_timeout = (api_connect_timeout, api_read_timeout)
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=api_connect_timeout, sock_read=api_read_timeout
+        )
+        self.log = get_dagster_logger()
+        self.token_cache = get_token_cache(token_cache_path)
+        self.api_max_attempts = api_max_attempts
+        self.api_min_requests_per_second = api_min_requests_per_second
+        self.api_latency_target_seconds = api_latency_target_seconds
+        # keyed by base_url like the threaded client so both
+        # engines share one rate limit and retry budget
+        self.rate_limiter = get_shared_rate_limiter(
+            base_url,
+            max_rate=requests_per_second,
+            min_rate=api_min_requests_per_second,
+            latency_target=api_latency_target_seconds,
+        )
+        self.retry_budget = get_shared_retry_budget(base_url)
+        self.retry_stats = {"retries": 0, "retry_wait_seconds": 0.0}
+        self.retry_stats_lock = threading.Lock()
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            headers={"Accept-Encoding": "gzip, deflate"},
+            timeout=self.timeout,
+        )
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    # page sizes and urls are built as in the threaded client
+    get_page_limit = EdFiApiClient.get_page_limit
+    _build_data_url = EdFiApiClient._build_data_url
+
+    async def get_access_token(self):
+        """
+        Retrieve access token from Ed-Fi API,
+        reusing a cached token when possible.
+        """
+        # the token cache is shared with the threaded client
+        # and may block on its file lock, so run it off the loop
+        return await asyncio.to_thread(
+            self.token_cache.get_token,
+            self.base_url,
+            self.api_key,
+            lambda: request_access_token(
+                self.base_url,
+                self.api_key,
+                self.api_secret,
+                timeout=self.token_timeout,
+            ),
+        )
+
+    @retry(
+        stop=stop_after_max_attempts,
+        wait=wait_for_retry,
+        retry=should_retry,
+        before_sleep=record_retry,
+        reraise=True,
+    )
+    async def _get(self, url) -> Tuple[List[Dict], Dict[str, str]]:
+        """
+        Call GET on passed in URL and return
+        the decoded response and its headers.
+        """
+        rate_limiter = self.rate_limiter
+        wait = rate_limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        access_token = await self.get_access_token()
+        headers = {"Authorization": f"Bearer {access_token}"}
+        self.retry_budget.record_request()
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                async with self.session.get(url, headers=headers) as response:
+                    if response.status == 401:
+                        self.log.info("Access token rejected. Retrieving new access token")
+                        self.token_cache.invalidate(self.base_url, self.api_key, access_token)
+                    if not response.ok:
+                        self.log.warn(f"Failed to retrieve data: {response.status} {response.reason}")
+                        response.raise_for_status()
+
+                    page = await response.json(content_type=None)
+                    headers = dict(response.headers)
+            except aiohttp.ClientResponseError as err:
+                rate_limiter.record_response(
+                    err.status, time.perf_counter() - start, get_retry_after(err)
+                )
+                raise err
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                rate_limiter.record_response(None, time.perf_counter() - start)
+                raise err
+
+        rate_limiter.record_response(response.status, time.perf_counter() - start)
+        return page, headers
+
+    async def _call_api(self, url):
+        """
+        Call GET on passed in URL and
+        return response.
+        """
+        page, _ = await self._get(url)
+        return page
+
+    async def get_total_count(
+        self,
+        api_endpoint: str,
+        school_year: int,
+        min_change_version: int = -1,
+        max_change_version: int = -1,
+    ) -> Optional[int]:
+        """
+        Return the number of records in an endpoint
+        using the Total-Count header, or None if the
+        endpoint does not report it.
+        """
+        _, headers = await self._get(
+            self._build_data_url(
+                api_endpoint, school_year, 1, min_change_version, max_change_version
+            )
+            + "&offset=0&totalCount=true"
+        )
+        total_count = headers.get("Total-Count")
+
+        return int(total_count) if total_count is not None else None
+
+    async def get_data(
+        self,
+        api_endpoint: str,
+        school_year: int,
+        previous_change_version: int,
+        newest_change_version: int,
+        concurrency: Optional[int] = None,
+        start_offset: int = 0,
+        total_count: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        Page through API endpoint using change version
+        numbers and yield each page in offset order,
+        starting at start_offset. Up to concurrency
+        pages are requested at once.
+
+        As in the threaded client, pages are planned
+        from the Total-Count of the endpoint. When it
+        does not report a count, paging stops at the
+        first short page.
+        """
+        concurrency = concurrency or self.api_concurrency
+        limit = self.get_page_limit(api_endpoint)
+        endpoint = self._build_data_url(
+            api_endpoint, school_year, limit, previous_change_version, newest_change_version
+        )
+
+        if total_count is None:
+            total_count = await self.get_total_count(
+                api_endpoint, school_year, previous_change_version, newest_change_version
+            )
+        if total_count is None:
+            self.log.info(f"{api_endpoint} does not report Total-Count. Paging until a short page")
+            end_offset = None
+        else:
+            end_offset = total_count
+
+        in_flight = list()
+        next_offset = start_offset
+
+        def request_next_page():
+            nonlocal next_offset
+            if end_offset is not None and next_offset >= end_offset:
+                return
+            endpoint_to_call = f"{endpoint}&offset={next_offset}"
+            self.log.debug(endpoint_to_call)
+            in_flight.append(asyncio.ensure_future(self._call_api(endpoint_to_call)))
+            next_offset = next_offset + limit
+
+        try:
+            for _ in range(max(concurrency, 1)):
+                request_next_page()
+
+            while in_flight:
+                response = await in_flight.pop(0)
+                if not response:
+                    # retrieved all data from api
+                    break
+
+                yield response
+
+                if end_offset is None and len(response) < limit:
+                    # a short page is the last page
+                    break
+
+                request_next_page()
+        finally:
+            for task in in_flight:
+                task.cancel()
@@ -1,12 +1,31 @@
-from typing import List, Dict
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 from logging import Logger
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-import base64
+import itertools
+import math
 import requests
 import os
+import re
+import threading
+import time
 
 from dagster import get_dagster_logger, resource, ConfigurableResource, Config, EnvVar
-from tenacity import retry, stop_after_attempt, wait_exponential
+from requests.adapters import HTTPAdapter
+from tenacity import retry
+
+from resources.edfi_retry import (
+    get_error_status,
+    get_retry_after,
+    get_shared_rate_limiter,
+    get_shared_retry_budget,
+    record_retry,
+    should_retry,
+    stop_after_max_attempts,
+    wait_for_retry,
+)
+from resources.edfi_token_cache import get_token_cache, request_access_token
 
 class EdFiCurrentYearConfig(Config):
     base_url: str = {'env': 'EDFI_BASE_URL'}
@@ -18,6 +37,77 @@ class EdFiCurrentYearConfig(Config):
     school_year: str = {'env': 'CURRENT_SCHOOL_YEAR'}
     staging_gcs_bucket: str = {'env': 'GCS_BUCKET_DEV'}
     use_change_queries: bool = False
+    api_concurrency: Optional[int] = None  # overrides EdFiApiResource.api_concurrency when set
+    output_format: str = os.getenv("EDFI_DATA_LAKE_FORMAT", "json")  # json, json_gzip, parquet
+    parquet_row_group_size: Optional[int] = None
+    target_file_bytes: int = 0  # 0 with target_file_rows 0 writes one file per api page
+    target_file_rows: int = 0
+    pipeline_queue_size: int = 4  # pages fetched ahead of the uploader. 0 fetches inline
+    spool_dir: Optional[str] = os.getenv("EDFI_SPOOL_DIR")  # stage files on disk before upload
+    spool_max_bytes: int = 1024 * 1024 * 1024
+    profile_mode: Optional[str] = None  # cprofile, tracemalloc
+    partitioned_extraction: bool = False  # split change version window into shallow slices
+    max_pages_per_partition: int = 20
+
+
+def build_session(pool_size: int) -> requests.Session:
+    """
+    Return a keep-alive session with a connection
+    pool of pool_size.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(
+        {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+    )
+
+    return session
+
+
+def get_session_pool_stats(session: requests.Session) -> Dict[str, int]:
+    """
+    Count connections opened and requests sent across
+    the connection pools of a session.
+    """
+    connections_opened = 0
+    requests_sent = 0
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+            connections_opened += pool.num_connections
+            requests_sent += pool.num_requests
+
+    return {
+        "connections_opened": connections_opened,
+        "requests_sent": requests_sent,
+    }
+
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    """
+    Return the p50, p95, p99 and max of a list
+    of latencies using the nearest rank method.
+    """
+    if not latencies:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+
+    ordered = sorted(latencies)
+
+    def percentile(pct):
+        return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+    return {
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": ordered[-1],
+    }
 
 
 # https://api.ed-fi.org/v3.2.0/docs/index.html?urls.primaryName=Resources#/
@@ -25,7 +115,10 @@ class EdFiApiClient:
     """Class for interacting with an Ed-Fi API"""
 
     def __init__(
-        self, base_url, api_key, api_secret, api_page_limit, api_mode, api_version
+        self, base_url, api_key, api_secret, api_page_limit, api_mode, api_version,
+        api_concurrency=1, api_connect_timeout=10.0, api_read_timeout=300.0,
+        token_cache_path=None, api_max_attempts=8, api_max_requests_per_second=20.0,
+        api_min_requests_per_second=1.0, api_latency_target_seconds=None,
     ):
         self.base_url = base_url
         self.api_key = api_key
@@ -33,50 +126,198 @@ class EdFiApiClient:
         self.api_page_limit = api_page_limit
         self.api_mode = api_mode
         self.api_version = api_version
+        self.api_concurrency = api_concurrency
+        self.timeout = (api_connect_timeout, api_read_timeout)
         self.log = get_dagster_logger()
-        self.access_token = self.get_access_token()
+        # one session per client so pool stats are not
+        # mixed with other clients in the process. the
+        # pool is sized to the client's concurrency and
+        # grown when a call asks for more.
+        self.pool_size = max(api_concurrency, 1)
+        self.session = build_session(self.pool_size)
+        self.pool_lock = threading.Lock()
+        self._pool_stats_baseline = get_session_pool_stats(self.session)
+        self.token_cache = get_token_cache(token_cache_path)
+        self.api_max_attempts = api_max_attempts
+        self.rate_limiter = get_shared_rate_limiter(
+            base_url,
+            max_rate=api_max_requests_per_second,
+            min_rate=api_min_requests_per_second,
+            latency_target=api_latency_target_seconds,
+        )
+        self._throttled_seconds_baseline = self.rate_limiter.throttled_seconds
+        self.retry_budget = get_shared_retry_budget(base_url)
+        self.retry_stats = {"retries": 0, "retry_wait_seconds": 0.0}
+        self.retry_stats_lock = threading.Lock()
+        self._reset_request_stats()
+        self.request_stats_lock = threading.Lock()
 
-    def get_access_token(self):
+    def _reset_request_stats(self):
+        self.request_stats = {"latencies": [], "response_bytes": 0, "decode_seconds": 0.0}
+
+    @property
+    def access_token(self) -> str:
         """
-        Retrieve access token from Ed-Fi API.
+        Access token from the shared token cache. A new
+        token is only requested when the cached one is
+        missing or about to expire.
         """
-        credentials_concatenated = ":".join((self.api_key, self.api_secret))
-        credentials_encoded = base64.b64encode(credentials_concatenated.encode("utf-8"))
-        access_url = f"{self.base_url}/oauth/token"
-        access_headers = {"Authorization": b"Basic " + credentials_encoded}
-        access_params = {"grant_type": "client_credentials"}
-
-        response = requests.post(access_url, headers=access_headers, data=access_params)
+        return self.get_access_token()
 
-        if response.ok:
-            response_json = response.json()
-            access_token = response_json["access_token"]
-            self.log.debug(f"Retrieved access token {access_token}")
-            return access_token
-        else:
-            raise Exception("Failed to retrieve access token")
+    def get_access_token(self):
+        """
+        Retrieve access token from Ed-Fi API,
+        reusing a cached token when possible.
+        """
+        return self.token_cache.get_token(
+            self.base_url,
+            self.api_key,
+            lambda: request_access_token(
+                self.base_url,
+                self.api_key,
+                self.api_secret,
+                session=self.session,
+                timeout=self.timeout,
+            ),
+        )
 
     @retry(
-        stop=stop_after_attempt(8), wait=wait_exponential(multiplier=1, min=4, max=10)
+        stop=stop_after_max_attempts,
+        wait=wait_for_retry,
+        retry=should_retry,
+        before_sleep=record_retry,
+        reraise=True,
     )
-    def _call_api(self, url):
+    def _send_request(self, url, method="GET", json=None) -> requests.Response:
         """
-        Call GET on passed in URL and
-        return response.
+        Call method, GET by default, on passed in
+        URL and return the successful response.
+
+        Requests are paced by the shared adaptive rate
+        limiter. Retryable failures are retried with
+        back-off, honouring Retry-After.
         """
-        headers = {"Authorization": f"Bearer {self.access_token}"}
+        access_token = self.access_token
+        headers = {"Authorization": f"Bearer {access_token}"}
+        self.rate_limiter.acquire()
+        self.retry_budget.record_request()
+        start = time.perf_counter()
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.request(
+                method, url, headers=headers, json=json, timeout=self.timeout
+            )
             response.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            self.log.warn(f"Failed to retrieve data: {err}")
-            self.log.warn(response.reason)
-            if response.status_code == 401:
-                self.log.info("Retrieving new access token")
-                self.access_token = self.get_access_token()
+        except requests.exceptions.RequestException as err:
+            self.rate_limiter.record_response(
+                get_error_status(err), time.perf_counter() - start, get_retry_after(err)
+            )
+            self.log.warn(f"Failed to {method} {url}: {err}")
+            if get_error_status(err) == 401:
+                self.log.info("Access token rejected. Retrieving new access token")
+                self.token_cache.invalidate(self.base_url, self.api_key, access_token)
             raise err
+        latency = time.perf_counter() - start
+        self.rate_limiter.record_response(response.status_code, latency)
+        with self.request_stats_lock:
+            self.request_stats["latencies"].append(latency)
+
+        return response
+
+    def _call_api(self, url):
+        """
+        Call GET on passed in URL and
+        return response.
+        """
+        response = self._send_request(url)
+        with self.request_stats_lock:
+            self.request_stats["response_bytes"] += len(response.content)
+
+        start = time.perf_counter()
+        page = response.json()
+        with self.request_stats_lock:
+            self.request_stats["decode_seconds"] += time.perf_counter() - start
+
+        return page
+
+    def pop_request_stats(self) -> Dict:
+        """
+        Return the latency of each request, decoded
+        response bytes and JSON decode time since the
+        last call, and start counting again.
+        """
+        with self.request_stats_lock:
+            request_stats = self.request_stats
+            self._reset_request_stats()
+
+        return request_stats
+
+    @staticmethod
+    def _is_empty_page(response) -> bool:
+        return not response
+
+    def get_retry_stats(self) -> Dict[str, float]:
+        """
+        Return retries made by this client, the time
+        spent waiting on them and the time requests
+        were held back by the rate limiter.
+        """
+        with self.retry_stats_lock:
+            return {
+                "retries": self.retry_stats["retries"],
+                "retry_wait_seconds": self.retry_stats["retry_wait_seconds"],
+                "throttled_seconds": (
+                    self.rate_limiter.throttled_seconds - self._throttled_seconds_baseline
+                ),
+                "requests_per_second": self.rate_limiter.rate,
+            }
 
-        return response.json()
+    def _get_concurrency(self, concurrency: Optional[int]) -> int:
+        """
+        Return the number of concurrent requests to
+        use, growing the connection pool to fit it.
+        """
+        concurrency = max(concurrency or self.api_concurrency, 1)
+        with self.pool_lock:
+            if concurrency > self.pool_size:
+                self.log.info(
+                    f"Growing the connection pool from {self.pool_size} to {concurrency}"
+                )
+                self._resize_pool(concurrency)
+
+        return concurrency
+
+    def _resize_pool(self, pool_size: int):
+        """
+        Mount an adapter with a pool of pool_size on
+        the session. Connections opened by the old
+        pool still count towards the pool stats.
+        """
+        current = get_session_pool_stats(self.session)
+        for name in self._pool_stats_baseline:
+            self._pool_stats_baseline[name] -= current[name]
+
+        adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool_size = pool_size
+
+    def get_pool_stats(self) -> Dict[str, int]:
+        """
+        Return connections opened and reused by this
+        client's session since the client was created.
+        """
+        current = get_session_pool_stats(self.session)
+        connections_opened = (
+            current["connections_opened"] - self._pool_stats_baseline["connections_opened"]
+        )
+        requests_sent = (
+            current["requests_sent"] - self._pool_stats_baseline["requests_sent"]
+        )
+
+        return {
+            "connections_opened": connections_opened,
+            "connections_reused": max(requests_sent - connections_opened, 0),
+        }
 
     def get_available_change_versions(self, school_year) -> List[Dict]:
         """
@@ -90,51 +331,308 @@ class EdFiApiClient:
 
         return self._call_api(endpoint)
 
+    def get_page_limit(self, api_endpoint: str) -> int:
+        """
+        Return the number of records requested
+        per page for the passed in endpoint.
+        """
+        return 5000 if "/deletes" in api_endpoint else self.api_page_limit
+
     def get_data(
         self,
         api_endpoint: str,
         school_year: int,
         previous_change_version: int,
         newest_change_version: int,
+        concurrency: Optional[int] = None,
+        start_offset: int = 0,
+        total_count: Optional[int] = None,
     ) -> List[Dict]:
         """
         Page through API endpoint using change version
-        numbers and return response.
+        numbers and return response, starting at
+        start_offset.
+
+        The number of records is requested once with
+        totalCount and every page is planned up front, so
+        no request is made past the last page. Pass
+        total_count if it is already known. When the
+        endpoint does not report a count, pages are
+        requested until a short page is returned.
+
+        When concurrency is greater than 1, up to that many
+        pages are requested at once. Pages are still yielded
+        in offset order.
         """
-        limit = 5000 if "/deletes" in api_endpoint else self.api_page_limit
+        concurrency = self._get_concurrency(concurrency)
+        limit = self.get_page_limit(api_endpoint)
+        endpoint = self._build_data_url(
+            api_endpoint, school_year, limit, previous_change_version, newest_change_version
+        )
 
-        if self.api_mode == "YearSpecific":
-            endpoint = (
-                f"{self.base_url}/data/v3/{school_year}{api_endpoint}" f"?limit={limit}"
+        if total_count is None:
+            total_count = self.get_total_count(
+                api_endpoint, school_year, previous_change_version, newest_change_version
             )
-        else:
-            endpoint = f"{self.base_url}/data/v3{api_endpoint}" f"?limit={limit}"
 
-        if previous_change_version > -1 and newest_change_version > -1:
-            endpoint = (
-                f"{endpoint}"
-                f"&minChangeVersion={previous_change_version}"
-                f"&maxChangeVersion={newest_change_version}"
+        if total_count is not None:
+            offsets = range(start_offset, total_count, limit)
+            pages = self._get_pages_in_order(
+                (f"{endpoint}&offset={offset}" for offset in offsets),
+                concurrency,
+                stop_when_empty=False,
+            )
+            yield from self._log_progress(api_endpoint, pages, len(offsets))
+            return
+
+        self.log.info(f"{api_endpoint} does not report Total-Count. Paging until a short page")
+        if concurrency > 1:
+            pages = self._get_pages_in_order(
+                (
+                    f"{endpoint}&offset={offset}"
+                    for offset in itertools.count(start_offset, limit)
+                ),
+                concurrency,
+                stop_when_empty=True,
             )
+            for response in pages:
+                if self._is_empty_page(response):
+                    break
+                yield response
+                if self._is_last_page(response, limit):
+                    break
+            pages.close()
+            return
 
-        offset = 0
+        offset = start_offset
         while True:
             endpoint_to_call = f"{endpoint}&offset={offset}"
             self.log.debug(endpoint_to_call)
             response = self._call_api(endpoint_to_call)
 
+            if self._is_empty_page(response):
+                # retrieved all data from api
+                break
+
             # yield response allowing records
             # to be stored while continuing to pull
             # new records
             yield response
 
-            if not response:
-                # retrieved all data from api
+            if self._is_last_page(response, limit):
                 break
             else:
                 # move onto next page
                 offset = offset + limit
 
+    @staticmethod
+    def _is_last_page(response, limit: int) -> bool:
+        return len(response) < limit
+
+    def _log_progress(self, api_endpoint: str, pages, total_pages: int):
+        """
+        Yield pages from pages, logging progress and
+        an estimate of the time remaining about every
+        tenth of the planned pages.
+        """
+        start = time.perf_counter()
+        log_every = max(total_pages // 10, 1)
+        for page_number, page in enumerate(pages, start=1):
+            yield page
+            if page_number % log_every == 0 or page_number == total_pages:
+                elapsed = time.perf_counter() - start
+                remaining = elapsed / page_number * (total_pages - page_number)
+                self.log.info(
+                    f"{api_endpoint}: {page_number} of {total_pages} pages, "
+                    f"about {remaining:.0f}s remaining"
+                )
+
+    def _build_data_url(
+        self,
+        api_endpoint: str,
+        school_year: int,
+        limit: int,
+        min_change_version: int = -1,
+        max_change_version: int = -1,
+    ) -> str:
+        """
+        Build the url of a resource endpoint without
+        an offset, filtered to a change version range
+        when both versions are set.
+        """
+        if self.api_mode == "YearSpecific":
+            endpoint = (
+                f"{self.base_url}/data/v3/{school_year}{api_endpoint}" f"?limit={limit}"
+            )
+        else:
+            endpoint = f"{self.base_url}/data/v3{api_endpoint}" f"?limit={limit}"
+
+        if min_change_version > -1 and max_change_version > -1:
+            endpoint = (
+                f"{endpoint}"
+                f"&minChangeVersion={min_change_version}"
+                f"&maxChangeVersion={max_change_version}"
+            )
+
+        return endpoint
+
+    def get_total_count(
+        self,
+        api_endpoint: str,
+        school_year: int,
+        min_change_version: int = -1,
+        max_change_version: int = -1,
+    ) -> Optional[int]:
+        """
+        Return the number of records in an endpoint
+        using the Total-Count header, or None if the
+        endpoint does not report it.
+        """
+        response = self._send_request(
+            self._build_data_url(
+                api_endpoint, school_year, 1, min_change_version, max_change_version
+            )
+            + "&offset=0&totalCount=true"
+        )
+        total_count = response.headers.get("Total-Count")
+
+        return int(total_count) if total_count is not None else None
+
+    def plan_change_version_partitions(
+        self,
+        api_endpoint: str,
+        school_year: int,
+        min_change_version: int,
+        max_change_version: int,
+        max_pages_per_partition: int,
+    ) -> Optional[List[Tuple[int, int, int]]]:
+        """
+        Split a change version window into ranges holding
+        at most max_pages_per_partition pages each, so no
+        request has to skip deep into the results.
+
+        Returns (min, max, record count) tuples in change
+        version order, or None if the endpoint does not
+        report a total count.
+        """
+        max_records = self.get_page_limit(api_endpoint) * max_pages_per_partition
+        ranges = [(min_change_version, max_change_version)]
+        partitions = list()
+        while ranges:
+            low, high = ranges.pop()
+            count = self.get_total_count(api_endpoint, school_year, low, high)
+            if count is None:
+                return None
+            if count == 0:
+                continue
+            if count <= max_records or low >= high:
+                partitions.append((low, high, count))
+            else:
+                middle = (low + high) // 2
+                # lower half is popped first, keeping version order
+                ranges.append((middle + 1, high))
+                ranges.append((low, middle))
+
+        return partitions
+
+    def get_data_partitioned(
+        self,
+        api_endpoint: str,
+        school_year: int,
+        previous_change_version: int,
+        newest_change_version: int,
+        max_pages_per_partition: int = 20,
+        concurrency: Optional[int] = None,
+        start_page: int = 0,
+    ) -> List[Dict]:
+        """
+        Page through API endpoint by splitting the change
+        version window into shallow partitions, planning
+        every page up front from the partition counts.
+
+        Pages are fetched concurrently and yielded in plan
+        order, starting at page number start_page. A full
+        extract partitions the window from 0 to the newest
+        change version. Endpoints without a total count
+        fall back to get_data.
+        """
+        concurrency = self._get_concurrency(concurrency)
+        limit = self.get_page_limit(api_endpoint)
+
+        if previous_change_version == -1 or newest_change_version == -1:
+            previous_change_version = 0
+            newest_change_version = self.get_available_change_versions(school_year)[
+                "NewestChangeVersion"
+            ]
+
+        partitions = self.plan_change_version_partitions(
+            api_endpoint,
+            school_year,
+            previous_change_version,
+            newest_change_version,
+            max_pages_per_partition,
+        )
+        if partitions is None:
+            self.log.info(f"{api_endpoint} does not report Total-Count. Paging by offset")
+            yield from self.get_data(
+                api_endpoint,
+                school_year,
+                previous_change_version,
+                newest_change_version,
+                concurrency,
+                start_offset=start_page * limit,
+            )
+            return
+
+        self.log.debug(f"Extracting {api_endpoint} in {len(partitions)} partitions")
+        page_urls = [
+            f"{self._build_data_url(api_endpoint, school_year, limit, low, high)}&offset={offset}"
+            for low, high, count in partitions
+            for offset in range(0, count, limit)
+        ]
+
+        pages = self._get_pages_in_order(
+            iter(page_urls[start_page:]), concurrency, stop_when_empty=False
+        )
+        yield from self._log_progress(api_endpoint, pages, len(page_urls) - start_page)
+
+    def _get_pages_in_order(
+        self, page_urls: Iterator[str], concurrency: int, stop_when_empty: bool = True,
+    ):
+        """
+        Keep a window of page requests in flight and
+        yield each page in order. With stop_when_empty,
+        stop after the first empty page.
+        """
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            in_flight = deque()
+
+            def request_next_page():
+                endpoint_to_call = next(page_urls, None)
+                if endpoint_to_call is None:
+                    return
+                self.log.debug(endpoint_to_call)
+                in_flight.append(executor.submit(self._call_api, endpoint_to_call))
+
+            try:
+                for _ in range(max(concurrency, 1)):
+                    request_next_page()
+
+                while in_flight:
+                    response = in_flight.popleft().result()
+                    yield response
+
+                    if stop_when_empty and self._is_empty_page(response):
+                        # retrieved all data from api
+                        break
+
+                    request_next_page()
+            finally:
+                # pages requested past the end, or after the
+                # consumer stopped, are discarded
+                for future in in_flight:
+                    future.cancel()
+
     def delete_data(self, id, school_year, api_endpoint) -> str:
         """ """
         headers = {"Authorization": f"Bearer {self.access_token}"}
@@ -146,7 +644,7 @@ class EdFiApiClient:
         self.log.debug(endpoint)
 
         try:
-            response = requests.delete(endpoint, headers=headers)
+            response = self.session.delete(endpoint, headers=headers, timeout=self.timeout)
             response.raise_for_status()
         except requests.exceptions.HTTPError as err:
             if response.status_code == 404:
@@ -173,7 +671,9 @@ class EdFiApiClient:
 
         generated_ids = list()
         for record in records:
-            response = requests.post(endpoint, headers=headers, json=record)
+            response = self.session.post(
+                endpoint, headers=headers, json=record, timeout=self.timeout
+            )
             response.raise_for_status()
             self.log.debug(f"Successfully posted {response.headers['location']}")
             generated_ids.append(response.headers["location"])
@@ -181,6 +681,134 @@ class EdFiApiClient:
         self.log.debug(generated_ids)
         return generated_ids
 
+    def _build_resource_url(self, school_year: int, api_endpoint: str) -> str:
+        if self.api_mode == "YearSpecific":
+            return f"{self.base_url}/data/v3/{school_year}/{api_endpoint}"
+
+        return f"{self.base_url}/data/v3/{api_endpoint}"
+
+    def _write_in_parallel(
+        self, write_record: Callable[[object], Dict], items: List, concurrency: Optional[int]
+    ) -> Dict:
+        """
+        Call write_record for every item on a bounded
+        thread pool and summarise the results. Results
+        are kept in the order of items.
+        """
+        concurrency = self._get_concurrency(concurrency)
+
+        def write(index_and_item):
+            index, item = index_and_item
+            start = time.perf_counter()
+            try:
+                result = write_record(item)
+                result["ok"] = True
+            except Exception as err:
+                # token, JSON and other errors are reported
+                # per record like HTTP errors
+                result = {
+                    "ok": False,
+                    "status": get_error_status(err),
+                    "error": str(err),
+                }
+            result["index"] = index
+            result["latency_seconds"] = time.perf_counter() - start
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            results = list(executor.map(write, enumerate(items)))
+
+        failed = [result for result in results if not result["ok"]]
+        for result in failed[:10]:
+            self.log.warn(f"Failed to write record {result['index']}: {result['error']}")
+
+        return {
+            "results": results,
+            "succeeded": len(results) - len(failed),
+            "failed": len(failed),
+            "latency_seconds": summarize_latencies(
+                [result["latency_seconds"] for result in results]
+            ),
+        }
+
+    def post_data_bulk(
+        self, records: List[Dict], school_year: int, api_endpoint: str,
+        concurrency: Optional[int] = None,
+    ) -> Dict:
+        """
+        POST records to passed in Ed-Fi API endpoint,
+        up to concurrency at a time.
+
+        Transient errors are retried per record. Ed-Fi
+        POST is an upsert on the natural key, so a retry
+        cannot create a duplicate. Failed records are
+        reported in the summary instead of raised.
+        """
+        endpoint = self._build_resource_url(school_year, api_endpoint)
+        self.log.debug(endpoint)
+
+        def post_record(record):
+            response = self._send_request(endpoint, method="POST", json=record)
+            return {"status": response.status_code, "location": response.headers.get("location")}
+
+        summary = self._write_in_parallel(post_record, records, concurrency)
+        self.log.info(
+            f"Posted {summary['succeeded']} records to {api_endpoint}, {summary['failed']} failed"
+        )
+        return summary
+
+    def delete_data_bulk(
+        self, ids: List[str], school_year: int, api_endpoint: str,
+        concurrency: Optional[int] = None,
+    ) -> Dict:
+        """
+        DELETE ids from passed in Ed-Fi API endpoint,
+        up to concurrency at a time.
+
+        Ids that do not exist count as deleted. Failed
+        deletes are reported in the summary instead of
+        raised.
+        """
+        endpoint = self._build_resource_url(school_year, api_endpoint)
+        self.log.debug(endpoint)
+
+        def delete_record(id):
+            try:
+                response = self._send_request(f"{endpoint}/{id}", method="DELETE")
+            except requests.exceptions.HTTPError as err:
+                if get_error_status(err) == 404:
+                    return {"status": 404, "id": id, "existed": False}
+                raise err
+            return {"status": response.status_code, "id": id, "existed": True}
+
+        summary = self._write_in_parallel(delete_record, ids, concurrency)
+        self.log.info(
+            f"Deleted {summary['succeeded']} ids from {api_endpoint}, {summary['failed']} failed"
+        )
+        return summary
+
+
+def get_tenant_credentials(
+    tenant: Optional[str], base_url: str, api_key: str, api_secret: str
+) -> Tuple[str, str, str]:
+    """
+    Return the base url, key and secret of a tenant
+    from EDFI_BASE_URL_<TENANT>, EDFI_API_KEY_<TENANT>
+    and EDFI_API_SECRET_<TENANT>. Each falls back to
+    the resource's value, so district specific tenants
+    sharing an instance only need their own key.
+    """
+    if not tenant:
+        return base_url, api_key, api_secret
+
+    suffix = re.sub(r"\W", "_", tenant).upper()
+
+    return (
+        os.getenv(f"EDFI_BASE_URL_{suffix}", base_url),
+        os.getenv(f"EDFI_API_KEY_{suffix}", api_key),
+        os.getenv(f"EDFI_API_SECRET_{suffix}", api_secret),
+    )
+
 
 # https://docs.dagster.io/guides/dagster/migrating-to-pythonic-resources-and-config#migrating-resources-that-use-separate-objects-for-business-logic
 # https://docs.dagster.io/_apidocs/resources#dagster.ConfigurableResource
@@ -192,14 +820,71 @@ class EdFiApiResource(ConfigurableResource):
     api_page_limit: int # = ""
     api_mode: str # = ""
     api_version: str # = ""
+    api_concurrency: int = 1
+    api_connect_timeout: float = 10.0
+    api_read_timeout: float = 300.0
+    async_max_concurrency: int = 16
+    async_requests_per_second: float = 20.0
+    token_cache_path: Optional[str] = None
+    api_max_attempts: int = 8
+    api_max_requests_per_second: float = 20.0
+    api_min_requests_per_second: float = 1.0
+    api_latency_target_seconds: Optional[float] = None
+
+    def init_edfi_resource(
+        self, tenant: Optional[str] = None, api_concurrency: Optional[int] = None
+    ) -> EdFiApiClient:
+        """
+        Return an EdFiApiClient for the resource's
+        instance, or for a tenant's when passed.
+        api_concurrency overrides the resource's.
+        """
+        base_url, api_key, api_secret = get_tenant_credentials(
+            tenant, self.base_url, self.api_key, self.api_secret
+        )
 
-    def init_edfi_resource(self) -> EdFiApiClient:
-        
         return EdFiApiClient(
-            self.base_url, 
-            self.api_key,
-            self.api_secret, 
+            base_url,
+            api_key,
+            api_secret,
+            self.api_page_limit,
+            self.api_mode,
+            self.api_version,
+            api_concurrency or self.api_concurrency,
+            self.api_connect_timeout,
+            self.api_read_timeout,
+            self.token_cache_path,
+            self.api_max_attempts,
+            self.api_max_requests_per_second,
+            self.api_min_requests_per_second,
+            self.api_latency_target_seconds,
+        )
+
+    def init_async_edfi_resource(self, tenant: Optional[str] = None):
+        """
+        Return an AsyncEdFiApiClient. Use it as an
+        async context manager inside an event loop.
+        """
+        from resources.edfi_api_async_resource import AsyncEdFiApiClient
+
+        base_url, api_key, api_secret = get_tenant_credentials(
+            tenant, self.base_url, self.api_key, self.api_secret
+        )
+
+        return AsyncEdFiApiClient(
+            base_url,
+            api_key,
+            api_secret,
             self.api_page_limit,
             self.api_mode,
             self.api_version,
+            self.api_concurrency,
+            self.async_max_concurrency,
+            self.async_requests_per_second,
+            self.api_connect_timeout,
+            self.api_read_timeout,
+            self.token_cache_path,
+            self.api_max_attempts,
+            self.api_min_requests_per_second,
+            self.api_latency_target_seconds,
         )
@@ -0,0 +1,272 @@
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import asyncio
+import threading
+import time
+
+import requests
+from tenacity import wait_random_exponential
+
+
+# statuses worth retrying. 401 is retried once the
+# rejected token has been dropped from the token cache.
+RETRYABLE_STATUS_CODES = {401, 408, 425, 429, 500, 502, 503, 504}
+
+# statuses that tell the client to slow down
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+def get_error_status(err: BaseException) -> Optional[int]:
+    """
+    Return the HTTP status of a requests or
+    aiohttp error, or None for connection errors.
+    """
+    response = getattr(err, "response", None)
+    if response is not None and hasattr(response, "status_code"):
+        return response.status_code
+
+    return getattr(err, "status", None)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Return the number of seconds in a Retry-After
+    header given as seconds or as an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_retry_after(err: BaseException) -> Optional[float]:
+    """
+    Return the Retry-After of a failed response
+    in seconds, if the server sent one.
+    """
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None) or getattr(err, "headers", None)
+    if not headers:
+        return None
+
+    return parse_retry_after(headers.get("Retry-After"))
+
+
+def is_retryable_error(err: BaseException) -> bool:
+    """
+    Return True for connection errors, timeouts
+    and retryable HTTP statuses. Other client
+    errors such as 400 or 404 are fatal.
+    """
+    status = get_error_status(err)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+
+    return isinstance(
+        err,
+        (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            ConnectionError,
+            TimeoutError,
+            asyncio.TimeoutError,
+        ),
+    ) or type(err).__module__.startswith("aiohttp")
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of the requests sent,
+    plus a minimum, so a struggling API is not
+    flooded with retries from every request at once.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 20):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def try_spend(self) -> bool:
+        """
+        Take a retry from the budget. Returns
+        False once the budget is used up.
+        """
+        with self.lock:
+            if self.retries >= self.min_retries + self.ratio * self.requests:
+                return False
+            self.retries += 1
+            return True
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket limiting requests per second. The
+    rate grows additively while responses are fast and
+    successful and is cut multiplicatively (AIMD) on
+    slow responses, 429/5xx responses and Retry-After,
+    which also pauses the bucket for the given time.
+    """
+
+    def __init__(
+        self,
+        max_rate: float = 20.0,
+        min_rate: float = 1.0,
+        increase: float = 0.5,
+        decrease_factor: float = 0.5,
+        latency_target: Optional[float] = None,
+    ):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.rate = max_rate
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.throttled_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token and return how many seconds
+        the caller must wait before sending.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(1.0, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1.0
+
+            wait = max(-self.tokens / self.rate, self.paused_until - now, 0.0)
+            self.throttled_seconds += wait
+            return wait
+
+    def acquire(self):
+        """
+        Block until a request may be sent.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self, latency: float):
+        with self.lock:
+            if self.latency_target and latency > self.latency_target:
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def record_response(self, status: Optional[int], latency: float, retry_after: Optional[float] = None):
+        """
+        Adjust the rate from the outcome of a request.
+        A status of None is a connection error.
+        """
+        if status is None or status in THROTTLE_STATUS_CODES or status >= 500:
+            self.on_throttle(retry_after)
+        elif status < 400:
+            self.on_success(latency)
+
+
+_RATE_LIMITERS = dict()
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def get_shared_rate_limiter(base_url: str, **kwargs) -> AdaptiveRateLimiter:
+    """
+    Return the rate limiter shared by every
+    client in the process for a base url.
+    """
+    with _RATE_LIMITERS_LOCK:
+        if base_url not in _RATE_LIMITERS:
+            _RATE_LIMITERS[base_url] = AdaptiveRateLimiter(**kwargs)
+
+        return _RATE_LIMITERS[base_url]
+
+
+_RETRY_BUDGETS = dict()
+_RETRY_BUDGETS_LOCK = threading.Lock()
+
+
+def get_shared_retry_budget(base_url: str, **kwargs) -> RetryBudget:
+    """
+    Return the retry budget shared by every
+    client in the process for a base url.
+    """
+    with _RETRY_BUDGETS_LOCK:
+        if base_url not in _RETRY_BUDGETS:
+            _RETRY_BUDGETS[base_url] = RetryBudget(**kwargs)
+
+        return _RETRY_BUDGETS[base_url]
+
+
+_jittered_backoff = wait_random_exponential(multiplier=1, max=60)
+
+
+def should_retry(retry_state) -> bool:
+    """
+    tenacity retry condition for client methods.
+    The client is the first argument of the call.
+    """
+    if not retry_state.outcome.failed:
+        return False
+
+    client = retry_state.args[0]
+    err = retry_state.outcome.exception()
+    if not is_retryable_error(err):
+        return False
+    if not client.retry_budget.try_spend():
+        client.log.warn("Retry budget exhausted, not retrying")
+        return False
+
+    return True
+
+
+def stop_after_max_attempts(retry_state) -> bool:
+    """
+    tenacity stop condition using the client's
+    api_max_attempts setting.
+    """
+    return retry_state.attempt_number >= retry_state.args[0].api_max_attempts
+
+
+def wait_for_retry(retry_state) -> float:
+    """
+    tenacity wait honouring Retry-After, falling
+    back to jittered exponential back-off.
+    """
+    retry_after = get_retry_after(retry_state.outcome.exception())
+    if retry_after is not None:
+        return min(retry_after, 300.0)
+
+    return _jittered_backoff(retry_state)
+
+
+def record_retry(retry_state):
+    """
+    tenacity before_sleep hook counting retries
+    and the time spent waiting on them.
+    """
+    client = retry_state.args[0]
+    with client.retry_stats_lock:
+        client.retry_stats["retries"] += 1
+        client.retry_stats["retry_wait_seconds"] += retry_state.next_action.sleep
@@ -0,0 +1,180 @@
+from typing import Callable, Dict, Optional, Tuple
+
+import base64
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from dagster import get_dagster_logger
+
+
+def request_access_token(
+    base_url: str,
+    api_key: str,
+    api_secret: str,
+    session: Optional[requests.Session] = None,
+    timeout=None,
+) -> Tuple[str, int]:
+    """
+    Retrieve access token from Ed-Fi API and
+    return it with its lifetime in seconds.
+    """
+    credentials_concatenated = ":".join((api_key, api_secret))
+    credentials_encoded = base64.b64encode(credentials_concatenated.encode("utf-8"))
+    access_url = f"{base_url}/oauth/token"
+    access_headers = {"Authorization": b"Basic " + credentials_encoded}
+    access_params = {"grant_type": "client_credentials"}
+
+    response = (session or requests).post(
+        access_url, headers=access_headers, data=access_params, timeout=timeout
+    )
+
+    if response.ok:
+        response_json = response.json()
+        return response_json["access_token"], int(response_json.get("expires_in", 0))
+    else:
+        raise Exception("Failed to retrieve access token")
+
+
+class EdFiTokenCache:
+    """
+    Cache of Ed-Fi access tokens shared by every client
+    in the process. Tokens are refreshed before they
+    expire. When cache_path is set, tokens are also
+    stored in a lock protected file so other processes
+    on the same machine can reuse them.
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, refresh_margin: int = 60):
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self.tokens = dict()
+        self.lock = threading.Lock()
+        self.log = get_dagster_logger()
+
+    @staticmethod
+    def _cache_key(base_url: str, api_key: str) -> str:
+        # never store the secret. key and url are hashed
+        # so the cache file does not reveal them either.
+        return hashlib.sha256(f"{base_url}|{api_key}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _is_fresh(entry: Optional[Dict]) -> bool:
+        return entry is not None and entry["refresh_at"] > time.time()
+
+    def _build_entry(self, access_token: str, expires_in: int) -> Dict:
+        now = time.time()
+        if expires_in <= 0:
+            # no lifetime reported. only reuse within
+            # the refresh margin.
+            expires_in = self.refresh_margin
+        margin = min(self.refresh_margin, expires_in / 2)
+
+        return {
+            "access_token": access_token,
+            "expires_at": now + expires_in,
+            "refresh_at": now + expires_in - margin,
+        }
+
+    def _read_file(self) -> Dict:
+        try:
+            with open(self.cache_path, "r") as cache_file:
+                return json.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            return dict()
+
+    def _write_file(self, entries: Dict):
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        file_descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, "w") as cache_file:
+            json.dump(entries, cache_file)
+        os.replace(temp_path, self.cache_path)
+
+    def get_token(
+        self, base_url: str, api_key: str, fetch_token: Callable[[], Tuple[str, int]]
+    ) -> str:
+        """
+        Return a cached access token, calling fetch_token
+        if there is no token or it is about to expire.
+        """
+        key = self._cache_key(base_url, api_key)
+        with self.lock:
+            entry = self.tokens.get(key)
+            if self._is_fresh(entry):
+                return entry["access_token"]
+
+            if not self.cache_path:
+                entry = self._build_entry(*fetch_token())
+                self.log.debug("Retrieved new access token")
+                self.tokens[key] = entry
+                return entry["access_token"]
+
+            # hold the file lock while fetching so that only
+            # one process requests a new token at a time
+            with open(f"{self.cache_path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    entries = self._read_file()
+                    entry = entries.get(key)
+                    if self._is_fresh(entry):
+                        self.log.debug("Reusing access token from token cache file")
+                    else:
+                        entry = self._build_entry(*fetch_token())
+                        self.log.debug("Retrieved new access token")
+                        entries = {
+                            cached_key: cached_entry
+                            for cached_key, cached_entry in entries.items()
+                            if cached_entry["expires_at"] > time.time()
+                        }
+                        entries[key] = entry
+                        self._write_file(entries)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            self.tokens[key] = entry
+            return entry["access_token"]
+
+    def invalidate(self, base_url: str, api_key: str, access_token: str):
+        """
+        Drop a token rejected by the API so the next
+        call to get_token fetches a new one.
+        """
+        key = self._cache_key(base_url, api_key)
+        with self.lock:
+            entry = self.tokens.get(key)
+            if entry is not None and entry["access_token"] == access_token:
+                del self.tokens[key]
+
+            if not self.cache_path:
+                return
+
+            with open(f"{self.cache_path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    entries = self._read_file()
+                    entry = entries.get(key)
+                    if entry is not None and entry["access_token"] == access_token:
+                        del entries[key]
+                        self._write_file(entries)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_TOKEN_CACHES = dict()
+_TOKEN_CACHES_LOCK = threading.Lock()
+
+
+def get_token_cache(cache_path: Optional[str] = None) -> EdFiTokenCache:
+    """
+    Return the process wide token cache
+    for the passed in cache file.
+    """
+    with _TOKEN_CACHES_LOCK:
+        if cache_path not in _TOKEN_CACHES:
+            _TOKEN_CACHES[cache_path] = EdFiTokenCache(cache_path)
+
+        return _TOKEN_CACHES[cache_path]
@@ -1,32 +1,129 @@
 import csv
+import gzip
+import io
 import json
 import uuid
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 from dagster import get_dagster_logger
 from dagster import resource, ConfigurableResource, Config, InitResourceContext
 from google.cloud import exceptions, storage
+from pydantic import PrivateAttr
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from resources.storage_backends import LocalStorageClient, MemoryStorageClient
 
 class GcsConfig(Config):
     staging_gcs_bucket: str = os.getenv("GCS_BUCKET_DEV")
     
 class GcsClient:
-    """Class for loading data into GCS"""
+    """
+    Class for loading data into GCS. Set
+    storage_backend to local or memory to store
+    files on local disk or in memory instead.
+    """
+
+    STORAGE_BACKENDS = ("gcs", "local", "memory")
+
+    # resumable upload chunks must be a multiple of 256 KiB
+    DEFAULT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+    def __init__(
+        self, staging_gcs_bucket, upload_chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE,
+        delete_batch_size=100, delete_concurrency=8, storage_backend="gcs",
+        local_storage_root=None, fsync_batch_size=100,
+    ):
+        if storage_backend not in self.STORAGE_BACKENDS:
+            raise ValueError(f"Unsupported storage backend {storage_backend}")
+        if storage_backend == "local" and not local_storage_root:
+            raise ValueError("local_storage_root is required for the local storage backend")
 
-    def __init__(self, staging_gcs_bucket):
         self.staging_gcs_bucket = staging_gcs_bucket
+        self.upload_chunk_size = upload_chunk_size
+        self.delete_batch_size = delete_batch_size
+        self.delete_concurrency = delete_concurrency
+        self.storage_backend = storage_backend
+        self.local_storage_root = local_storage_root
+        self.fsync_batch_size = fsync_batch_size
         self.log = get_dagster_logger()
+        self._storage_client = None
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    @property
+    def storage_client(self) -> storage.Client:
+        """
+        Storage client created on first use
+        and reused for every call after.
+        """
+        with self._lock:
+            if self._storage_client is None:
+                if self.storage_backend == "local":
+                    self._storage_client = LocalStorageClient(
+                        self.local_storage_root, self.fsync_batch_size
+                    )
+                elif self.storage_backend == "memory":
+                    self._storage_client = MemoryStorageClient()
+                else:
+                    self._storage_client = storage.Client()
+
+        return self._storage_client
+
+    def bucket(self) -> storage.Bucket:
+        """
+        Return a handle to the staging bucket without
+        checking that it exists. A missing bucket
+        surfaces as NotFound on first use.
+        """
+        storage_client = self.storage_client
+        with self._lock:
+            if self._bucket is None:
+                self._bucket = storage_client.bucket(self.staging_gcs_bucket)
+
+        return self._bucket
+
+    def get_uri(self, path: str) -> str:
+        """
+        Return the uri of a file in the bucket.
+        """
+        if self.storage_backend == "local":
+            return f"file://{os.path.abspath(self.local_storage_root)}/{self.staging_gcs_bucket}/{path}"
+        if self.storage_backend == "memory":
+            return f"memory://{self.staging_gcs_bucket}/{path}"
+
+        return f"gs://{self.staging_gcs_bucket}/{path}"
+
+    def sync(self):
+        """
+        Make written files durable. Only the local
+        backend defers this, fsyncing in batches.
+        """
+        if self.storage_backend != "gcs":
+            self.bucket().sync()
 
     def delete_files(self, gcs_path):
         """
         Delete all files in passed in bucket folder
         """
-        storage_client = storage.Client()
-        bucket = storage_client.get_bucket(self.staging_gcs_bucket)
-        blobs = list(bucket.list_blobs(prefix=gcs_path))
-        for blob in blobs:
-            blob.delete()
+        blobs = list(self.bucket().list_blobs(prefix=gcs_path))
+        batches = [
+            blobs[index:index + self.delete_batch_size]
+            for index in range(0, len(blobs), self.delete_batch_size)
+        ]
+
+        def delete_batch(batch):
+            # each batch is sent as a single http request
+            with self.storage_client.batch():
+                for blob in batch:
+                    blob.delete()
+
+        with ThreadPoolExecutor(max_workers=self.delete_concurrency) as executor:
+            list(executor.map(delete_batch, batches))
 
         self.log.info(f"Deleted {len(blobs)} files from {gcs_path}")
 
@@ -35,50 +132,162 @@ class GcsClient:
         Upload dataframe to GCS as CSV
         and return GCS folder path.
         """
+        self.log.debug(
+            f"Uploading {file_name} to {self.get_uri(folder_name)}"
+        )
+
         try:
-            storage_client = storage.Client()
-            bucket = storage_client.get_bucket(self.staging_gcs_bucket)
+            self.bucket().blob(f"{folder_name}/{file_name}").upload_from_string(
+                df.to_csv(index=False, quoting=csv.QUOTE_ALL),
+                content_type="text/csv",
+                num_retries=3,
+            )
         except exceptions.NotFound:
             self.log.error("Sorry, that bucket does not exist!")
             raise
 
-        self.log.debug(
-            f"Uploading {file_name} to gs://{self.staging_gcs_bucket}/{folder_name}"
-        )
-
-        bucket.blob(f"{folder_name}/{file_name}").upload_from_string(
-            df.to_csv(index=False, quoting=csv.QUOTE_ALL),
-            content_type="text/csv",
-            num_retries=3,
-        )
-
-        return f"gs://{self.staging_gcs_bucket}/{folder_name}/{file_name}"
+        return self.get_uri(f"{folder_name}/{file_name}")
 
     def upload_json(self, path, records) -> str:
         """
         Upload list of dictionaries to gcs
         as a JSON file.
         """
-        storage_client = storage.Client()
-        bucket = storage_client.get_bucket(self.staging_gcs_bucket)
+        return self.upload_ndjson(path, (json.dumps(record) for record in records))
 
-        output = ""
-        for record in records:
-            output = output + json.dumps(record) + "\r\n"
+    def upload_ndjson(self, path, lines, compression: Optional[str] = None) -> str:
+        """
+        Upload an iterable of serialised JSON records to
+        gcs as a newline delimited JSON file, gzip
+        compressed when compression is "gzip".
 
-        bucket.blob(path).upload_from_string(
-            output, content_type="application/json", num_retries=3
-        )
-        gcs_upload_path = f"gs://{self.staging_gcs_bucket}/{path}"
+        Lines are written to a buffer once. Files smaller
+        than the upload chunk size are sent in a single
+        request, larger files are streamed with a resumable
+        upload so memory stays bounded by the chunk size.
+        """
+        blob = self.bucket().blob(path)
+        content_type = "application/gzip" if compression == "gzip" else "application/json"
+
+        buffer = io.BytesIO()
+        output = gzip.GzipFile(fileobj=buffer, mode="wb") if compression == "gzip" else buffer
+        writer = None
+
+        def flush_buffer():
+            nonlocal writer
+            if writer is None:
+                writer = blob.open(
+                    "wb", chunk_size=self.upload_chunk_size, content_type=content_type
+                )
+            writer.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+
+        for line in lines:
+            if isinstance(line, str):
+                line = line.encode("utf-8")
+            output.write(line)
+            output.write(b"\r\n")
+
+            if buffer.tell() >= self.upload_chunk_size:
+                flush_buffer()
+
+        if output is not buffer:
+            # writes the gzip trailer to the buffer
+            output.close()
+
+        if writer is None:
+            # upload the buffer itself rather than a copy
+            blob.upload_from_file(
+                buffer, rewind=True, content_type=content_type, num_retries=3
+            )
+        else:
+            flush_buffer()
+            writer.close()
+
+        gcs_upload_path = self.get_uri(path)
         self.log.debug(f"Uploaded JSON file to {gcs_upload_path}")
 
         return gcs_upload_path
 
+    def upload_parquet(self, path, columns: Dict[str, List], schema, row_group_size=None) -> str:
+        """
+        Upload a dictionary of column lists to gcs as
+        a snappy compressed Parquet file.
+        """
+        table = pa.Table.from_pydict(columns, schema=schema)
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, row_group_size=row_group_size, compression="snappy")
+
+        self.bucket().blob(path).upload_from_string(
+            buffer.getvalue(), content_type="application/vnd.apache.parquet", num_retries=3
+        )
+        gcs_upload_path = self.get_uri(path)
+        self.log.debug(f"Uploaded Parquet file to {gcs_upload_path}")
+
+        return gcs_upload_path
+
+    def upload_file(self, path, file_name: str, content_type: str) -> str:
+        """
+        Upload a local file to gcs. Large files
+        are sent with a resumable upload.
+        """
+        blob = self.bucket().blob(path, chunk_size=self.upload_chunk_size)
+        blob.upload_from_filename(file_name, content_type=content_type, num_retries=3)
+        gcs_upload_path = self.get_uri(path)
+        self.log.debug(f"Uploaded file to {gcs_upload_path}")
+
+        return gcs_upload_path
+
+    def download_json(self, path) -> Optional[Dict]:
+        """
+        Download a JSON file from gcs and return
+        its contents, or None if it does not exist.
+        """
+        try:
+            return json.loads(self.bucket().blob(path).download_as_bytes())
+        except exceptions.NotFound:
+            return None
+
+    def upload_bytes(self, path, data: bytes, content_type="application/json") -> str:
+        """
+        Upload bytes to gcs as is. Used for small
+        files such as checkpoints and profiles.
+        """
+        self.bucket().blob(path).upload_from_string(
+            data, content_type=content_type, num_retries=3
+        )
+        gcs_upload_path = self.get_uri(path)
+        self.log.debug(f"Uploaded file to {gcs_upload_path}")
+
+        return gcs_upload_path
+
 
 # https://docs.dagster.io/guides/dagster/migrating-to-pythonic-resources-and-config#migrating-resources-that-use-separate-objects-for-business-logic
 # https://docs.dagster.io/_apidocs/resources#dagster.ConfigurableResource
 class GcsResource(ConfigurableResource):
     staging_gcs_bucket: str
+    upload_chunk_size: int = GcsClient.DEFAULT_UPLOAD_CHUNK_SIZE
+    delete_batch_size: int = 100
+    delete_concurrency: int = 8
+    storage_backend: str = "gcs"  # gcs, local, memory
+    local_storage_root: Optional[str] = None
+    fsync_batch_size: int = 100
+
+    _gcs_client: Optional[GcsClient] = PrivateAttr(default=None)
 
     def init_gcs_resource(self) -> GcsClient:
-        return GcsClient(self.staging_gcs_bucket)
\ No newline at end of file
+        # reuse one client, and its storage client and
+        # bucket handle, for every call in this process
+        if self._gcs_client is None:
+            self._gcs_client = GcsClient(
+                self.staging_gcs_bucket,
+                self.upload_chunk_size,
+                self.delete_batch_size,
+                self.delete_concurrency,
+                self.storage_backend,
+                self.local_storage_root,
+                self.fsync_batch_size,
+            )
+
+        return self._gcs_client
\ No newline at end of file
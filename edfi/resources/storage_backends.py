@@ -0,0 +1,283 @@
+from contextlib import contextmanager
+from typing import Dict, List
+
+import os
+import threading
+
+from google.cloud import exceptions
+
+
+# storage backends have the small part of the
+# google.cloud.storage Client, Bucket and Blob
+# interface that GcsClient uses, so the same client
+# code runs against GCS, local disk or memory.
+
+
+class LocalBlobWriter:
+    """
+    File object for a local blob. Data is written to a
+    temporary file that replaces the blob on close, so
+    readers never see a partly written file.
+    """
+
+    def __init__(self, blob: "LocalBlob"):
+        self.blob = blob
+        os.makedirs(os.path.dirname(blob.file_path), exist_ok=True)
+        self.temp_path = f"{blob.file_path}.{threading.get_ident()}.tmp"
+        self.file = open(self.temp_path, "wb")
+
+    def write(self, data) -> int:
+        return self.file.write(data)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        os.replace(self.temp_path, self.blob.file_path)
+        self.blob.bucket.written(self.blob.file_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.temp_path)
+
+
+class LocalBlob:
+    """
+    Blob stored as a file under the bucket directory.
+    """
+
+    def __init__(self, bucket: "LocalBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.file_path = os.path.join(bucket.directory, name)
+
+    def upload_from_string(self, data, content_type=None, num_retries=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with LocalBlobWriter(self) as writer:
+            writer.write(data)
+
+    def upload_from_file(self, file_obj, rewind=False, content_type=None, num_retries=None):
+        if rewind:
+            file_obj.seek(0)
+        with LocalBlobWriter(self) as writer:
+            while True:
+                chunk = file_obj.read(1024 * 1024)
+                if not chunk:
+                    break
+                writer.write(chunk)
+
+    def upload_from_filename(self, file_name, content_type=None, num_retries=None):
+        with open(file_name, "rb") as source_file:
+            self.upload_from_file(source_file)
+
+    def open(self, mode="rb", chunk_size=None, content_type=None):
+        if mode == "wb":
+            return LocalBlobWriter(self)
+
+        return open(self.file_path, mode)
+
+    def download_as_bytes(self) -> bytes:
+        try:
+            with open(self.file_path, "rb") as blob_file:
+                return blob_file.read()
+        except FileNotFoundError:
+            raise exceptions.NotFound(self.name)
+
+    def delete(self):
+        try:
+            os.remove(self.file_path)
+        except FileNotFoundError:
+            raise exceptions.NotFound(self.name)
+
+
+class LocalBucket:
+    """
+    Bucket stored in a local directory. Written files
+    are fsynced in batches of fsync_batch_size, and on
+    sync, rather than one at a time. Set fsync_batch_size
+    to 0 to never fsync, for benchmarks.
+    """
+
+    def __init__(self, directory: str, fsync_batch_size: int = 100):
+        self.directory = directory
+        self.fsync_batch_size = fsync_batch_size
+        self._unsynced = list()
+        self._lock = threading.Lock()
+
+    def blob(self, name: str, chunk_size=None) -> LocalBlob:
+        return LocalBlob(self, name)
+
+    def list_blobs(self, prefix: str = ""):
+        for directory, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if file_name.endswith(".tmp"):
+                    continue
+                name = os.path.relpath(os.path.join(directory, file_name), self.directory)
+                if name.startswith(prefix):
+                    yield LocalBlob(self, name)
+
+    def written(self, file_path: str):
+        if not self.fsync_batch_size:
+            return
+
+        with self._lock:
+            self._unsynced.append(file_path)
+            if len(self._unsynced) < self.fsync_batch_size:
+                return
+            unsynced, self._unsynced = self._unsynced, list()
+
+        self._fsync(unsynced)
+
+    def sync(self):
+        """
+        fsync every file written since the last batch.
+        """
+        with self._lock:
+            unsynced, self._unsynced = self._unsynced, list()
+
+        self._fsync(unsynced)
+
+    @staticmethod
+    def _fsync(file_paths: List[str]):
+        directories = set()
+        for file_path in file_paths:
+            try:
+                file_descriptor = os.open(file_path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(file_descriptor)
+            finally:
+                os.close(file_descriptor)
+            directories.add(os.path.dirname(file_path))
+
+        # persist the renames as well as the contents
+        for directory in directories:
+            file_descriptor = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(file_descriptor)
+            finally:
+                os.close(file_descriptor)
+
+
+class LocalStorageClient:
+    """
+    Storage client keeping each bucket in a
+    directory under root_dir.
+    """
+
+    def __init__(self, root_dir: str, fsync_batch_size: int = 100):
+        self.root_dir = root_dir
+        self.fsync_batch_size = fsync_batch_size
+
+    def bucket(self, name: str) -> LocalBucket:
+        return LocalBucket(os.path.join(self.root_dir, name), self.fsync_batch_size)
+
+    @contextmanager
+    def batch(self):
+        yield
+
+
+class MemoryBlobWriter:
+    def __init__(self, blob: "MemoryBlob"):
+        self.blob = blob
+        self.chunks = list()
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def close(self):
+        self.blob.bucket.objects[self.blob.name] = b"".join(self.chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+
+
+class MemoryBlob:
+    """
+    Blob kept in the bucket's dictionary of objects.
+    """
+
+    def __init__(self, bucket: "MemoryBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None, num_retries=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.bucket.objects[self.name] = bytes(data)
+
+    def upload_from_file(self, file_obj, rewind=False, content_type=None, num_retries=None):
+        if rewind:
+            file_obj.seek(0)
+        self.bucket.objects[self.name] = file_obj.read()
+
+    def upload_from_filename(self, file_name, content_type=None, num_retries=None):
+        with open(file_name, "rb") as source_file:
+            self.upload_from_file(source_file)
+
+    def open(self, mode="rb", chunk_size=None, content_type=None):
+        if mode == "wb":
+            return MemoryBlobWriter(self)
+
+        raise ValueError(f"Unsupported mode {mode}")
+
+    def download_as_bytes(self) -> bytes:
+        try:
+            return self.bucket.objects[self.name]
+        except KeyError:
+            raise exceptions.NotFound(self.name)
+
+    def delete(self):
+        try:
+            del self.bucket.objects[self.name]
+        except KeyError:
+            raise exceptions.NotFound(self.name)
+
+
+class MemoryBucket:
+    """
+    Bucket kept in memory. Useful for
+    tests and development runs.
+    """
+
+    def __init__(self):
+        self.objects: Dict[str, bytes] = dict()
+
+    def blob(self, name: str, chunk_size=None) -> MemoryBlob:
+        return MemoryBlob(self, name)
+
+    def list_blobs(self, prefix: str = ""):
+        return [MemoryBlob(self, name) for name in list(self.objects) if name.startswith(prefix)]
+
+    def sync(self):
+        pass
+
+
+class MemoryStorageClient:
+    """
+    Storage client whose buckets live in memory
+    for as long as the client.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[str, MemoryBucket] = dict()
+
+    def bucket(self, name: str) -> MemoryBucket:
+        return self.buckets.setdefault(name, MemoryBucket())
+
+    @contextmanager
+    def batch(self):
+        yield
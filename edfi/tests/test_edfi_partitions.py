@@ -0,0 +1,57 @@
+from dagster import DagsterInstance, asset, materialize
+
+from assets.edfi_partitions import get_runs_awaiting_retry
+
+JOB_NAME = "__ephemeral_asset_job__"
+
+
+@asset
+def failing_extract():
+    raise Exception("Ed-Fi API unavailable")
+
+
+@asset
+def extract():
+    return 1
+
+
+def run_extract(instance, asset_def, tags):
+    return materialize(
+        [asset_def], instance=instance, tags=tags, raise_on_error=False
+    ).run_id
+
+
+def test_failed_run_awaits_retry_until_retry_is_launched():
+    instance = DagsterInstance.ephemeral(settings={"run_retries": {"enabled": True}})
+    failed_run_id = run_extract(instance, failing_extract, {"dagster/max_retries": "3"})
+
+    assert get_runs_awaiting_retry(instance, JOB_NAME) == [failed_run_id]
+
+    run_extract(
+        instance,
+        extract,
+        {
+            "dagster/max_retries": "3",
+            "dagster/retry_number": "1",
+            "dagster/parent_run_id": failed_run_id,
+            "dagster/root_run_id": failed_run_id,
+        },
+    )
+
+    assert get_runs_awaiting_retry(instance, JOB_NAME) == []
+
+
+def test_failed_run_without_retries_left_does_not_await_retry():
+    instance = DagsterInstance.ephemeral(settings={"run_retries": {"enabled": True}})
+    run_extract(
+        instance, failing_extract, {"dagster/max_retries": "3", "dagster/retry_number": "3"}
+    )
+
+    assert get_runs_awaiting_retry(instance, JOB_NAME) == []
+
+
+def test_failed_run_does_not_await_retry_when_retries_are_disabled():
+    instance = DagsterInstance.ephemeral()
+    run_extract(instance, failing_extract, {"dagster/max_retries": "3"})
+
+    assert get_runs_awaiting_retry(instance, JOB_NAME) == []